@@ -0,0 +1,439 @@
+"""
+bean_bitboard.py
+
+Author: MCK
+
+Bitboard version of the BeanMachine. Instead of a (13, 6) array,
+the playing field is stored as one integer bitmask per bean color
+plus one for every occupied space, and all of the game logic
+works on whole bitmasks at once:
+
+- Collision tests check a single bit of the occupancy mask.
+- Groups are found by shift-and-mask flood fill.
+- Gravity closes each gap in a column with one mask and shift.
+- Game Over is a single AND with the top row.
+
+Bit layout: space (Y, X) is bit X*14 + Y. Each column takes 13
+bits for its rows plus one spare bit that is always 0, so shifting
+a bitmask by 1 moves beans down or up a row without spilling into
+the next column, and shifting by 14 moves them across columns.
+
+BitBeanMachine has the same interface as BeanMachine. It also
+keeps the usual field array up to date alongside the bitboards
+(one write per changed space), so Gym environments and renderers
+work with either one without converting anything.
+
+BeanMachine's compiled kernels are faster in seeded mode, so this
+engine is mostly useful for whole-board group detection, and as an
+independent implementation of the rules to check BeanMachine
+against (see Benchmarks/bean_equivalence.py).
+"""
+
+import numpy as np
+
+from bean_machine import BeanMachine
+
+COLUMN      = 14                                                    # Bits per column
+COLUMN_MASK = (1 << 13) - 1                                         # Rows of one column
+FIELD_MASK  = sum(COLUMN_MASK << (x*COLUMN) for x in range(6))      # Every space
+TOP_ROW     = sum(1 << (x*COLUMN) for x in range(6))                # Row 0 of every column
+
+def cell_bit(y, x):
+    """
+    Bitmask with only space (Y, X) set.
+    """
+    return 1 << (x*COLUMN + y)
+
+def cells(bits):
+    """
+    List the (Y, X) coordinates of the spaces set in a bitmask.
+    """
+    coords = []
+    while bits:
+        low   = bits & -bits
+        x, y  = divmod(low.bit_length()-1, COLUMN)
+        bits ^= low
+        coords.append((y, x))
+    return coords
+
+def single_bits(bits):
+    """
+    Split a bitmask into single-bit masks, lowest bit first (column by 
+    column from the top left).
+    """
+    order = []
+    while bits:
+        low   = bits & -bits
+        bits ^= low
+        order.append(low)
+    return order
+
+def fallen_bits(bits):
+    """
+    Split a bitmask into single-bit masks, column by column from the 
+    bottom up: the order bean_kernels.compact_columns lists the beans 
+    that fell in.
+    """
+    order = []
+    for x in range(6):
+        o   = x*COLUMN
+        col = (bits >> o) & COLUMN_MASK
+        while col:
+            y    = col.bit_length()-1
+            col ^= 1 << y
+            order.append(1 << (o + y))
+    return order
+
+def popcount(bits):
+    """
+    Number of spaces set in a bitmask.
+    """
+    return bin(bits).count('1')
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count    # (Python 3.10+)
+
+def spread(bits):
+    """
+    Grow a bitmask by one space up, down, left and right.
+    """
+    return (bits | (bits << 1) | (bits >> 1) | (bits << COLUMN) | (bits >> COLUMN)) & FIELD_MASK
+
+def flood(bits, within):
+    """
+    Grow a bitmask through the spaces of another bitmask until it
+    covers every space connected to it.
+
+    Args:
+        bits (int): Starting spaces (must be part of within).
+        within (int): Spaces the fill may spread into.
+
+    Returns:
+        [int]: Bitmask of the connected spaces.
+    """
+    # (Inlined spread: within has no spare or out-of-field bits to mask off)
+    while True:
+        grown = (bits | (bits << 1) | (bits >> 1) | (bits << COLUMN) | (bits >> COLUMN)) & within
+        if grown == bits:
+            return bits
+        bits = grown
+
+def to_bitboards(field):
+    """
+    Convert a playing field array to bitboards.
+
+    Args:
+        field (np.ndarray): Playing field.
+
+    Returns:
+        [list[int]]: Seven bitmasks. Entry 0 holds every occupied space,
+                        and entry C holds the spaces with color C.
+    """
+    padded = np.zeros((7, 6, COLUMN), dtype=bool)
+    padded[0, :, :13]  = (field != 0).T
+    padded[1:, :, :13] = field.T == np.arange(1, 7).reshape(6, 1, 1)
+
+    packed = np.packbits(padded.reshape(7, -1), axis=1, bitorder='little')
+
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+def to_field(boards, out=None):
+    """
+    Convert bitboards to a playing field array.
+
+    Args:
+        boards (list[int]): Bitboards, as returned by to_bitboards.
+        out (np.ndarray, optional): (13, 6) array to write into.
+                                    Defaults to None, which allocates one.
+
+    Returns:
+        [np.ndarray]: Playing field.
+    """
+    if out is None:
+        out = np.zeros((13, 6), dtype=int)
+    else:
+        out[:] = 0
+
+    for c in range(1, 7):
+        if boards[c]:
+            bits = np.unpackbits(np.frombuffer(boards[c].to_bytes(11, 'little'), dtype=np.uint8),
+                                    bitorder='little')
+            out[bits[:6*COLUMN].reshape(6, COLUMN)[:, :13].T.astype(bool)] = c
+
+    return out
+
+def settle(boards):
+    """
+    Drop every bean into the lowest open space of its column.
+
+    Working up from the bottom of each column, every gap (a run of 
+    empty spaces under a bean) is closed by shifting everything above 
+    it down by the gap's height, in one mask and shift per board.
+
+    Args:
+        boards (list[int]): Bitboards, as returned by to_bitboards.
+
+    Returns:
+        [tuple]: (boards, moved, rows), the settled bitboards, a bitmask
+                    of the new positions of beans that moved, and the
+                    most rows any bean fell.
+    """
+    boards = list(boards)
+    moved  = 0
+    rows   = 0
+
+    for x in range(6):
+        o   = x*COLUMN
+        col = (boards[0] >> o) & COLUMN_MASK
+        if not col:
+            continue
+
+        # Empty spaces under the top bean (each one is a row it falls)
+        top   = (col & -col).bit_length()-1
+        empty = COLUMN_MASK & ~((1 << top) - 1) & ~col
+        if not empty:
+            continue
+
+        rows    = max(rows, popcount(empty))
+        deepest = empty.bit_length()-1
+
+        while empty:
+            bottom = empty.bit_length()-1                           # Lowest space of the lowest gap
+            fall   = bottom - (col & ((1 << bottom) - 1)).bit_length() + 1
+            above  = ((1 << (bottom - fall + 1)) - 1) << o          # Everything above the gap
+            keep   = ~(((1 << (bottom + 1)) - 1) << o)
+
+            for c in range(7):
+                b = boards[c]
+                if b & above:
+                    boards[c] = (b & keep) | ((b & above) << fall)
+
+            col   = (boards[0] >> o) & COLUMN_MASK
+            top   = (col & -col).bit_length()-1
+            empty = COLUMN_MASK & ~((1 << top) - 1) & ~col
+
+        # Everything that was above the deepest empty space has moved
+        moved |= (col & ((1 << (deepest+1)) - 1)) << o
+
+    return boards, moved, rows
+
+class BitBeanMachine(BeanMachine):
+    """
+    BeanMachine that keeps the playing field as bitboards. See the
+    module docstring for the layout.
+
+    The field array is updated along with the bitboards, so reading 
+    it costs nothing, and assigning an array to it converts that array 
+    to bitboards. Modifying the array in place does NOT change the 
+    game. Chains are always played out: the bitboard logic does not 
+    keep a Zobrist hash, so it does not use the transposition cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Instantiation. Takes the same arguments as BeanMachine.
+        """
+        self.boards = [0]*7
+        self._field = np.zeros((13, 6), dtype=int)
+
+        self.eliminate_bits = 0   # Beans in complete groups
+        self.dropped_bits   = 0   # Beans that moved in the last completion drop
+
+        super().__init__(*args, **kwargs)
+
+    @property
+    def field(self):
+        return self._field
+
+    @field.setter
+    def field(self, field):
+        self.boards = to_bitboards(field)
+        self._field = np.array(field, dtype=int)
+
+    def restore(self, snap):
+        """
+        Return the game to the state captured in a snapshot.
+        """
+        super().restore(snap)
+
+        # The snapshot's field was written into the field array
+        self.boards = to_bitboards(self._field)
+
+    def color_at(self, bit):
+        """
+        Color of the bean at the space set in a single-bit mask.
+        """
+        x, y = divmod(bit.bit_length()-1, COLUMN)
+        return self._field.item(y, x)
+
+    def free(self, y, x):
+        """
+        Check if (Y, X) is inside the field and empty.
+        """
+        return (0 <= y <= 12) and (0 <= x <= 5) and not ((self.boards[0] >> (x*COLUMN + y)) & 1)
+
+    def check_loss(self):
+        """
+        Check if the Game Over state has been reached.
+        """
+        # Reset combo counter
+        self.combo = 0
+
+        # Check if any beans are in top row
+        if self.boards[0] & TOP_ROW:
+            self.gameover = True
+            if self.listeners:
+                self.emit('game_over', score=self.score)
+
+        self.phase += 1
+
+    def bean_change(self, change_list):
+        """
+        Change the positions of beans on the field as they move.
+
+        Args:
+            change_list (list[tuples]): List of (Y, X, C) changes to make.
+        """
+        boards = self.boards
+        field  = self._field
+        for y, x, c in change_list:
+            bit = 1 << (x*COLUMN + y)
+            old = field.item(y, x)
+            if old:
+                boards[old] &= ~bit
+                boards[0]   &= ~bit
+            if c:
+                boards[c] |= bit
+                boards[0] |= bit
+            field[y, x] = c
+
+    def scatter(self, ys, xs, colors, n: int=None):
+        """
+        Change many spaces of the field at once, given as arrays. See 
+        BeanMachine.scatter.
+        """
+        if n is None:
+            n = len(ys)
+
+        self.bean_change(list(zip(ys[:n].tolist(), xs[:n].tolist(), colors[:n].tolist())))
+
+    def shift_pair(self, step):
+        """
+        Move the controlled beans by a pair transition, if the spaces it 
+        needs are free. See BeanMachine.shift_pair.
+
+        Returns:
+            [int]: 1 for successful movement, otherwise 0.
+        """
+        if step is None:
+            return 0
+
+        state, ya, xa, yb, xb, left = step
+        occupied = self.boards[0]
+        if ((occupied >> (xa*COLUMN + ya)) | (occupied >> (xb*COLUMN + yb))) & 1:
+            return 0
+
+        self.set_pair(state, left)
+
+        return 1
+
+    def dropcheck(self, y, x):
+        """
+        Check if the bean at (x,y) can NOT be dropped one space down.
+
+        Returns:
+            [bool]: False if the bean CAN drop, otherwise True.
+        """
+        return not self.free(y+1, x)
+
+    def completion_check(self):
+        """
+        Check for beans that have formed a group of 4 or
+        more neighbors.
+        """
+        boards = self.boards
+
+        # Beans that just moved, in the order BeanMachine checks them (the 
+        # pair as listed in dropped_yx, then fallen beans as listed by 
+        # compact_columns), since the first group to touch a black region 
+        # claims it. In whole-board mode every other bean is checked after 
+        # them, as in find_groups.
+        seeds = [cell_bit(y, x) for y, x in self.dropped_yx] + fallen_bits(self.dropped_bits)
+        if self.whole_board:
+            seeds += single_bits(boards[0] & ~boards[1])
+
+        # Beans that have not been counted in a group yet
+        remaining = boards[0]
+
+        self.eliminate_bits = 0
+        for bit in seeds:
+            if not bit & remaining:
+                continue
+            c = self.color_at(bit)
+            if c < 2:
+                continue
+
+            # The group, plus any black beans touching it
+            group   = flood(bit, boards[c] & remaining)
+            touched = spread(group) & boards[1] & remaining
+            if touched:
+                group |= flood(touched, boards[1] & remaining)
+
+            remaining &= ~group
+            if popcount(group) >= 4:
+                self.eliminate_bits |= group
+                self.combo += 1
+
+                if self.listeners:
+                    self.emit('group_cleared', cells=cells(group), color=c, combo=self.combo)
+
+        self.eliminate    = cells(self.eliminate_bits)
+        self.dropped_yx   = []
+        self.dropped_bits = 0
+        self.phase += 1
+
+    def remove_beans(self):
+        """
+        Remove any beans that are part of a completed group.
+        """
+        cleared     = popcount(self.eliminate_bits)
+        points      = self.combo*cleared
+        self.score += points
+
+        if self.listeners and points > 0:
+            self.emit('chain_step', combo=self.combo, cleared=cleared, points=points)
+            self.emit('score_changed', score=self.score, delta=points)
+
+        for c in range(7):
+            self.boards[c] &= ~self.eliminate_bits
+        for y, x in self.eliminate:
+            self._field[y, x] = 0
+
+        self.clock.tick()
+        self.phase += 1
+
+    def completion_drop(self):
+        """
+        Drop any beans that have open spaces somewhere below them
+        after beans have been removed from the field.
+        """
+        if self.eliminate_bits == 0:
+            self.phase = 0
+
+        else:
+            self.boards, self.dropped_bits, rows = settle(self.boards)
+
+            # Let the beans fall in the field array too, in the columns that moved
+            field = self._field
+            for x in range(6):
+                if (self.dropped_bits >> (x*COLUMN)) & COLUMN_MASK:
+                    column = field[:, x]
+                    beans  = column[column != 0]
+                    column[:] = 0
+                    column[13-len(beans):] = beans
+
+            for _ in range(rows):
+                self.clock.tick()
+
+            # Now that new beans have dropped, check for completion again
+            self.phase = 6
@@ -0,0 +1,326 @@
+"""
+bean_dataset.py
+
+Author: MCK
+
+Offline transition datasets for the MeanBean game, e.g. for
+offline RL or for filling a replay buffer before training.
+
+generate() plays headless BeanMachine games in a pool of worker
+processes under a policy (random, heuristic or planner), with no
+learner in the loop. The transitions (obs, action, reward,
+next_obs, done) are streamed into fixed-size shards of
+memory-mapped .npy files, one file per field:
+
+    <name>_obs.npy         uint8   (size, 13, 6)
+    <name>_action.npy      uint8   (size,)
+    <name>_reward.npy      int32   (size,)   (chains can score over 255)
+    <name>_next_obs.npy    uint8   (size, 13, 6)
+    <name>_done.npy        bool    (size,)
+
+manifest.json lists the shards and the settings they were made
+with. TransitionDataset samples from the shards through memory
+maps, so a dataset never has to fit in RAM.
+
+Run this file to generate a dataset from the command line.
+"""
+
+import argparse, json, os
+import multiprocessing as mp
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from bean_machine import BeanMachine, PLACEMENTS
+from bean_planner import BeamPlanner
+
+# Name, dtype and shape (per transition) of each field of a shard
+FIELDS = (('obs', np.uint8, (13, 6)),
+          ('action', np.uint8, ()),
+          ('reward', np.int32, ()),
+          ('next_obs', np.uint8, (13, 6)),
+          ('done', np.bool_, ()))
+
+class RandomPolicy():
+    """
+    Picks actions uniformly at random.
+    """
+
+    def __init__(self, placement: bool=True, seed: int=None):
+        self.actions = len(PLACEMENTS) if placement else 6
+
+    def __call__(self, machine: BeanMachine, rng: np.random.Generator):
+        return int(rng.integers(self.actions))
+
+class PlannerPolicy():
+    """
+    Plays the placements chosen by a BeamPlanner. With move-level
+    actions, it plans once per pair and then plays the moves that
+    steer the pair to the chosen placement.
+    """
+
+    def __init__(self, placement: bool=True, seed: int=None, depth: int=2, width: int=8):
+        """
+        Instantiation
+
+        Args:
+            placement (bool, optional): If True, return placements (indices
+                                    into PLACEMENTS). Otherwise return
+                                    BeanGymEnv moves. Defaults to True.
+            seed (int, optional): Seed of the planner's imagined beans.
+            depth, width (int, optional): Search settings (see BeamPlanner).
+        """
+        self.placement = placement
+        self.planner   = BeamPlanner(depth=depth, width=width, seed=seed)
+        self.moves     = []
+        self.pair      = None   # Bean index of the pair the moves are for
+
+    def __call__(self, machine: BeanMachine, rng: np.random.Generator):
+        if self.placement:
+            return self.planner.plan(machine).action
+
+        if len(self.moves) == 0 or self.pair != machine.bean_index:
+            self.moves = self.planner.plan(machine).actions
+            self.pair  = machine.bean_index
+
+        return self.moves.pop(0)
+
+def heuristic_policy(placement: bool=True, seed: int=None):
+    """
+    Greedy policy: the placement that looks best one pair ahead.
+    """
+    return PlannerPolicy(placement, seed, depth=1, width=1)
+
+# Policies that can be picked by name. Each entry makes a policy from
+# (placement, seed). A policy is called as policy(machine, rng) while the
+# game waits for movement, and returns an action.
+POLICIES = {'random': RandomPolicy,
+            'heuristic': heuristic_policy,
+            'planner': PlannerPolicy}
+
+def advance(machine: BeanMachine, action: int=0):
+    """
+    Take one BeanGymEnv step: apply the action and run the game until it
+    waits for the next one.
+    """
+    _ = machine.run_until_decision(action)
+
+def worker(path, index, transitions, shard_size, policy, placement, seed, frames_per_drop):
+    """
+    Play games and write their transitions to shards. Runs in a worker
+    process.
+
+    Args:
+        path (str): Dataset directory.
+        index (int): Worker number, used in the shard names.
+        transitions (int): Number of transitions to write.
+        shard_size (int): Transitions per shard (the last may be smaller).
+        policy (str or function): Name in POLICIES, or a function that makes
+                                    a policy from (placement, seed).
+        placement (bool): Whether actions are placements or moves.
+        seed (int): Seed of the worker's games and policy.
+        frames_per_drop (int): Engine setting.
+
+    Returns:
+        [list[dict]]: Name and size of each shard written.
+    """
+    rng     = np.random.default_rng(seed)
+    make    = POLICIES[policy] if isinstance(policy, str) else policy
+    act     = make(placement, int(rng.integers(2**63)))
+    machine = BeanMachine(seed=int(rng.integers(2**63)), headless=True,
+                            frames_per_drop=frames_per_drop)
+
+    # Bring in the first pair, so every transition starts at a decision
+    machine.reset()
+    advance(machine)
+
+    shards  = []
+    written = 0
+    while written < transitions:
+        size = min(shard_size, transitions - written)
+        name = f"shard_{index:03d}_{len(shards):05d}"
+
+        arrays = {field: open_memmap(os.path.join(path, f"{name}_{field}.npy"), mode='w+',
+                                        dtype=dtype, shape=(size,) + shape)
+                    for field, dtype, shape in FIELDS}
+        obs, actions, rewards, next_obs, dones = (arrays[field] for field, _, _ in FIELDS)
+
+        for i in range(size):
+            obs[i] = machine.field
+            score  = machine.score
+            action = act(machine, rng)
+
+            if placement:
+                machine.place(*PLACEMENTS[action])
+            else:
+                advance(machine, action)
+
+            actions[i]  = action
+            rewards[i]  = machine.score - score
+            next_obs[i] = machine.field
+            dones[i]    = machine.gameover
+
+            if machine.gameover:
+                machine.reseed(int(rng.integers(2**63)))
+                machine.reset()
+                advance(machine)
+
+        for array in arrays.values():
+            array.flush()
+        del obs, actions, rewards, next_obs, dones, arrays
+
+        shards.append({'name': name, 'size': size})
+        written += size
+
+    return shards
+
+def run_worker(args):
+    return worker(*args)
+
+def generate(path: str, transitions: int, workers: int=None, policy='random',
+                placement: bool=True, shard_size: int=100000, seed: int=0,
+                frames_per_drop: int=3, start_method: str=None):
+    """
+    Generate a transition dataset.
+
+    Args:
+        path (str): Dataset directory (created if needed).
+        transitions (int): Total number of transitions.
+        workers (int, optional): Number of worker processes. Defaults to
+                                    None, which uses one per CPU.
+        policy (str or function, optional): 'random', 'heuristic' or
+                                    'planner' (see POLICIES), or a picklable
+                                    function that makes a policy from
+                                    (placement, seed). Defaults to 'random'.
+        placement (bool, optional): If True, actions are placements (as in
+                                    BeanGymPlacementEnv). Otherwise they are
+                                    BeanGymEnv moves. Defaults to True.
+        shard_size (int, optional): Transitions per shard. Defaults to 100000.
+        seed (int, optional): Seed of the whole dataset. Defaults to 0.
+        frames_per_drop (int, optional): Engine setting. Defaults to 3.
+        start_method (str, optional): multiprocessing start method. Defaults
+                                    to None, which uses the platform default.
+
+    Returns:
+        [dict]: The manifest, also written to manifest.json.
+    """
+    os.makedirs(path, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, transitions))
+
+    # Split the transitions and seeds between the workers
+    counts = [transitions // workers + (w < transitions % workers) for w in range(workers)]
+    seeds  = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(workers)]
+    jobs   = [(path, w, counts[w], shard_size, policy, placement, seeds[w], frames_per_drop)
+                for w in range(workers)]
+
+    ctx = mp.get_context(start_method)
+    with ctx.Pool(workers) as pool:
+        shards = [shard for result in pool.map(run_worker, jobs) for shard in result]
+
+    manifest = {'transitions': transitions,
+                'policy': policy if isinstance(policy, str) else policy.__name__,
+                'placement': placement,
+                'frames_per_drop': frames_per_drop,
+                'seed': seed,
+                'fields': {field: [np.dtype(dtype).name, list(shape)]
+                            for field, dtype, shape in FIELDS},
+                'shards': shards}
+
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+class TransitionDataset():
+    """
+    Uniform sampling from a dataset made by generate(). The shards are
+    opened as read-only memory maps, so only the sampled transitions
+    are read from disk.
+    """
+
+    def __init__(self, path: str):
+        """
+        Instantiation
+
+        Args:
+            path (str): Dataset directory.
+        """
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+
+        self.shards = [{field: np.load(os.path.join(path, f"{shard['name']}_{field}.npy"),
+                                        mmap_mode='r')
+                        for field, _, _ in FIELDS}
+                        for shard in self.manifest['shards']]
+
+        # Index of each shard's first transition
+        sizes       = [shard['size'] for shard in self.manifest['shards']]
+        self.starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def get(self, indices):
+        """
+        Read transitions by index.
+
+        Args:
+            indices (np.ndarray): Indices into the whole dataset.
+
+        Returns:
+            [dict]: One array per field, in the order of indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        batch   = {field: np.empty((len(indices),) + shape, dtype=dtype)
+                    for field, dtype, shape in FIELDS}
+
+        shard_of = np.searchsorted(self.starts, indices, side='right') - 1
+        for s in np.unique(shard_of).tolist():
+            rows = np.nonzero(shard_of == s)[0]
+            local = indices[rows] - self.starts[s]
+
+            # Read each shard in file order
+            order = np.argsort(local, kind='stable')
+            rows  = rows[order]
+            local = local[order]
+
+            for field, _, _ in FIELDS:
+                batch[field][rows] = self.shards[s][field][local]
+
+        return batch
+
+    def sample(self, batch_size: int, rng: np.random.Generator=None):
+        """
+        Sample transitions uniformly at random (with replacement).
+
+        Args:
+            batch_size (int): Number of transitions.
+            rng (np.random.Generator, optional): Random generator. Defaults
+                                    to None, which uses a fresh one.
+
+        Returns:
+            [dict]: One array per field.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        return self.get(rng.integers(0, len(self), batch_size))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a MeanBean transition dataset.")
+    parser.add_argument('path', help="Dataset directory")
+    parser.add_argument('--transitions', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--moves', action='store_true',
+                        help="Record BeanGymEnv moves instead of placements")
+    parser.add_argument('--shard-size', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.path, args.transitions, workers=args.workers, policy=args.policy,
+                        placement=not args.moves, shard_size=args.shard_size, seed=args.seed)
+    print(f"Wrote {manifest['transitions']} transitions in {len(manifest['shards'])} shards")
@@ -0,0 +1,379 @@
+"""
+bean_kernels.py
+
+Author: MCK
+
+Compiled kernels for the hot paths of the BeanMachine (group
+detection, gravity after removing beans, landing checks and
+field writes),
+and the lookup tables that drive the controlled pair.
+
+The kernels are plain functions over the (13, 6) playing field
+and integer coordinates, compiled in nopython mode by numba.
+Compiled code is cached on disk next to this file (in
+__pycache__, or NUMBA_CACHE_DIR if set), so new worker
+processes load it instead of compiling again. If numba is not
+installed, the same functions run as ordinary Python. (Set
+NUMBA_DISABLE_JIT=1 to force the Python versions for debugging.)
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit that leaves the function as plain Python.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+# Orientations of Bean 2 relative to Bean 1, in clockwise order. Rotating
+# by direction d (1 = clockwise, -1 = counter) moves from index o to (o+d)%4.
+ORIENTATIONS = ('above', 'right', 'below', 'left')
+ORIENTATION_INDEX = {name: i for i, name in enumerate(ORIENTATIONS)}
+ABOVE, RIGHT, BELOW, LEFT = range(4)
+
+# (dY, dX) offset of Bean 2 from Bean 1 for each orientation index
+ORIENTATION_OFFSETS = np.array([[-1, 0], [0, 1], [1, 0], [0, -1]])
+
+# The controlled pair's position and orientation as one integer, its pair 
+# state: (orientation*13 + Y)*6 + X, with (Y, X) the space of Bean 1. States 
+# that would put Bean 2 outside the field never occur.
+PAIR_STATES = 4*13*6
+
+def pair_state(orientation, y1, x1):
+    """
+    Pair state of Bean 1 at (x1,y1) with Bean 2 in the given orientation.
+    """
+    return (orientation*13 + y1)*6 + x1
+
+SPAWN_STATE = pair_state(0, 1, 3)   # Where every new pair enters the field
+
+# Kinds of pair transition. A rotation tries the TURN, and if Bean 2 is 
+# blocked there, the KICK, which pushes Bean 1 away from it.
+MOVE_LEFT, MOVE_RIGHT, MOVE_DOWN, TURN_CCW, TURN_CW, KICK_CCW, KICK_CW = range(7)
+
+def build_pair_tables():
+    """
+    Precompute where the controlled pair ends up after every kind of 
+    transition from every pair state.
+
+    Returns:
+        [tuple]: (cells, steps). cells is a (PAIR_STATES, 4) array of the 
+                    (Y1, X1, Y2, X2) spaces of each state. steps is a 
+                    (7, PAIR_STATES, 5) array of (new state, Ya, Xa, Yb, Xb) 
+                    for each transition, where (Ya, Xa) and (Yb, Xb) are 
+                    the spaces that must be empty for it to succeed (the 
+                    same space twice if only one matters). The new state 
+                    is -1 where a transition would leave the field.
+    """
+    cells = np.zeros((PAIR_STATES, 4), dtype=np.int64)
+    steps = np.zeros((7, PAIR_STATES, 5), dtype=np.int64)
+    steps[:, :, 0] = -1
+
+    def inside(y, x):
+        return 0 <= y <= 12 and 0 <= x <= 5
+
+    for orientation in range(4):
+        dy, dx = ORIENTATION_OFFSETS[orientation].tolist()
+        for y1 in range(13):
+            for x1 in range(6):
+                state = pair_state(orientation, y1, x1)
+                y2, x2 = y1+dy, x1+dx
+                cells[state] = (y1, x1, y2, x2)
+                if not inside(y2, x2):
+                    continue
+
+                # Moves only need the spaces the beans do not already occupy
+                for kind, (my, mx) in ((MOVE_LEFT, (0, -1)), (MOVE_RIGHT, (0, 1)),
+                                        (MOVE_DOWN, (1, 0))):
+                    n1, m1, n2, m2 = y1+my, x1+mx, y2+my, x2+mx
+                    if not (inside(n1, m1) and inside(n2, m2)):
+                        continue
+
+                    new = [cell for cell in ((n1, m1), (n2, m2)) if cell not in ((y1, x1), (y2, x2))]
+                    (ya, xa), (yb, xb) = new[0], new[-1]
+                    steps[kind, state] = (pair_state(orientation, n1, m1), ya, xa, yb, xb)
+
+                # Rotations: Bean 2 swings round Bean 1, or Bean 1 is kicked away
+                for turn, kick, direction in ((TURN_CCW, KICK_CCW, -1), (TURN_CW, KICK_CW, 1)):
+                    rotated = (orientation + direction) % 4
+                    ry, rx  = ORIENTATION_OFFSETS[rotated].tolist()
+
+                    if inside(y1+ry, x1+rx):
+                        steps[turn, state] = (pair_state(rotated, y1, x1), y1+ry, x1+rx,
+                                                y1+ry, x1+rx)
+                    if inside(y1-ry, x1-rx):
+                        steps[kick, state] = (pair_state(rotated, y1-ry, x1-rx), y1-ry, x1-rx,
+                                                y1-ry, x1-rx)
+
+    return cells, steps
+
+def transition_tuples(cells, steps):
+    """
+    The pair transition tables as Python tuples, for the single-game 
+    engine, which reads them one entry at a time.
+
+    Returns:
+        [list[tuple]]: For each kind of transition, a tuple indexed by pair 
+                        state of None (off the field) or (new state, Ya, Xa, 
+                        Yb, Xb, spaces the pair leaves empty).
+    """
+    spaces = cells.tolist()
+    tables = []
+    for kind in range(7):
+        table = []
+        for state, (new, ya, xa, yb, xb) in enumerate(steps[kind].tolist()):
+            if new < 0:
+                table.append(None)
+                continue
+
+            y1, x1, y2, x2 = spaces[state]
+            n1, m1, n2, m2 = spaces[new]
+            left = tuple(cell for cell in ((y1, x1), (y2, x2)) if cell not in ((n1, m1), (n2, m2)))
+            table.append((new, ya, xa, yb, xb, left))
+
+        tables.append(tuple(table))
+
+    return tables
+
+PAIR_CELLS, PAIR_STEPS = build_pair_tables()
+PAIR_SPACES      = [tuple(cells) for cells in PAIR_CELLS.tolist()]  # (Y1, X1, Y2, X2) by state
+PAIR_TRANSITIONS = transition_tuples(PAIR_CELLS, PAIR_STEPS)
+
+@njit(cache=True)
+def landed(field, y, x):
+    """
+    Check if the bean at (x,y) can NOT drop one space down.
+
+    Returns:
+        [bool]: False if the bean CAN drop, otherwise True.
+    """
+    return ((y+1) > 12) or (field[y+1, x] > 0)
+
+@njit(cache=True)
+def flood_group(snap, y, x, ys, xs):
+    """
+    Find the group of beans connected to the bean at (x,y), along
+    with any black beans touching it. Found beans are blanked out
+    of the snapshot so they are not counted twice.
+
+    Args:
+        snap (np.ndarray): Snapshot of the playing field (modified).
+        y, x (int): Coordinates of a bean in the group.
+        ys, xs (np.ndarray): Buffers of at least 78 entries that receive
+                                the coordinates of the beans in the group.
+
+    Returns:
+        [int]: Number of beans in the group.
+    """
+    # Stack of beans still to visit, with the color each one must match.
+    # Black beans are searched with color -1, so they only spread to
+    # other black beans.
+    stack_y = np.empty(78, dtype=np.int64)
+    stack_x = np.empty(78, dtype=np.int64)
+    stack_c = np.empty(78, dtype=np.int64)
+
+    stack_y[0] = y
+    stack_x[0] = x
+    stack_c[0] = snap[y, x]
+    snap[y, x] = 0
+    top   = 1
+    count = 0
+
+    while top > 0:
+        top -= 1
+        y = stack_y[top]
+        x = stack_x[top]
+        c = stack_c[top]
+
+        ys[count] = y
+        xs[count] = x
+        count += 1
+
+        for i in range(4):
+            yn = y + ORIENTATION_OFFSETS[i, 0]
+            xn = x + ORIENTATION_OFFSETS[i, 1]
+            if yn < 0 or yn > 12 or xn < 0 or xn > 5:
+                continue
+
+            cn = snap[yn, xn]
+            if cn == c or cn == 1:
+                stack_y[top] = yn
+                stack_x[top] = xn
+                stack_c[top] = c if cn == c else -1
+                snap[yn, xn] = 0
+                top += 1
+
+    return count
+
+@njit(cache=True)
+def compact_columns(field, clear_x, cleared, ys, xs, falls, keys, hashing, h):
+    """
+    Let the beans fall to the bottom of every column that had beans 
+    cleared from it, in one stable bottom-to-top pass per column, 
+    keeping a Zobrist hash up to date.
+
+    Args:
+        field (np.ndarray): Playing field (modified).
+        clear_x (np.ndarray): Columns of the beans that were cleared.
+        cleared (int): Number of entries of clear_x to use.
+        ys, xs (np.ndarray): Buffers of at least 78 entries that receive 
+                                the new coordinates of the beans that fell.
+        falls (np.ndarray): Buffer that receives how many rows each fell.
+        keys (np.ndarray): (13, 6, 7) uint64 Zobrist keys.
+        hashing (bool): Whether to update the hash.
+        h (np.uint64): Zobrist hash of the field before the drop.
+
+    Returns:
+        [tuple]: (number of beans that fell, most rows any bean fell, 
+                    Zobrist hash of the field after the drop)
+    """
+    columns = np.zeros(6, dtype=np.bool_)
+    for i in range(cleared):
+        columns[clear_x[i]] = True
+
+    n    = 0
+    rows = 0
+    for x in range(6):
+        if not columns[x]:
+            continue
+
+        # Next free row from the bottom
+        free = 12
+        for y in range(12, -1, -1):
+            c = field[y, x]
+            if c == 0:
+                continue
+
+            if y != free:
+                field[y, x]    = 0
+                field[free, x] = c
+                if hashing:
+                    h ^= keys[y, x, c] ^ keys[free, x, c]
+
+                ys[n]    = free
+                xs[n]    = x
+                falls[n] = free - y
+                rows     = max(rows, free - y)
+                n += 1
+
+            free -= 1
+
+    return n, rows, h
+
+@njit(cache=True)
+def scatter(field, ys, xs, colors, n, keys, hashing, h):
+    """
+    Write colors into spaces of the field in order, so a later change 
+    to the same space wins, keeping a Zobrist hash up to date in the 
+    same pass.
+
+    Args:
+        field (np.ndarray): Playing field (modified).
+        ys, xs, colors (np.ndarray): Coordinates and new colors of the 
+                                        spaces to change.
+        n (int): Number of changes to apply (from the start of the arrays).
+        keys (np.ndarray): (13, 6, 7) uint64 Zobrist keys.
+        hashing (bool): Whether to update the hash.
+        h (np.uint64): Zobrist hash of the field before the changes.
+
+    Returns:
+        [np.uint64]: Zobrist hash of the field after the changes.
+    """
+    for i in range(n):
+        y = ys[i]
+        x = xs[i]
+        c = colors[i]
+        if hashing:
+            h ^= keys[y, x, field[y, x]] ^ keys[y, x, c]
+        field[y, x] = c
+
+    return h
+
+@njit(cache=True)
+def resolve_chain(field, seed_y, seed_x, seeds, combo, links, keys, hashing, h):
+    """
+    Play out a whole chain on a playing field: remove every complete 
+    group that contains a seed bean, let the beans above fall, and 
+    repeat from the beans that fell until no group is complete. The 
+    same steps as BeanMachine phases 6-8, without the phases.
+
+    Args:
+        field (np.ndarray): Playing field (modified).
+        seed_y, seed_x (np.ndarray): Coordinates of the beans that just 
+                                        moved. 
+        seeds (int): Number of seed coordinates.
+        combo (int): Combo count before the chain.
+        links (np.ndarray): (20, 2) buffer that receives the groups and 
+                                beans cleared in each link of the chain 
+                                (every link clears at least 4 of the 78 
+                                spaces, so there are at most 19).
+        keys (np.ndarray): (13, 6, 7) uint64 Zobrist keys.
+        hashing (bool): Whether to update the hash.
+        h (np.uint64): Zobrist hash of the field before the chain.
+
+    Returns:
+        [tuple]: (links in the chain, points scored, combo count after 
+                    the chain, frames the chain takes, Zobrist hash of 
+                    the field after it)
+    """
+    snap    = np.empty_like(field)
+    group_y = np.empty(78, dtype=np.int64)
+    group_x = np.empty(78, dtype=np.int64)
+    clear_y = np.empty(78, dtype=np.int64)
+    clear_x = np.empty(78, dtype=np.int64)
+    fell_y  = np.empty(max(78, seeds), dtype=np.int64)
+    fell_x  = np.empty(max(78, seeds), dtype=np.int64)
+    falls   = np.empty(78, dtype=np.int64)
+
+    fell_y[:seeds] = seed_y[:seeds]
+    fell_x[:seeds] = seed_x[:seeds]
+
+    chain  = 0
+    score  = 0
+    frames = 0
+    while True:
+        # Find the complete groups among the beans that moved
+        snap[:] = field
+        groups  = 0
+        cleared = 0
+        for i in range(seeds):
+            y = fell_y[i]
+            x = fell_x[i]
+            if snap[y, x] > 1:
+                count = flood_group(snap, y, x, group_y, group_x)
+                if count >= 4:
+                    clear_y[cleared:cleared+count] = group_y[:count]
+                    clear_x[cleared:cleared+count] = group_x[:count]
+                    cleared += count
+                    groups  += 1
+
+        frames += 1     # Removing beans takes a frame, even if there are none
+        if groups == 0:
+            break
+
+        combo += groups
+        score += combo*cleared
+        links[chain, 0] = groups
+        links[chain, 1] = cleared
+        chain += 1
+
+        for i in range(cleared):
+            y = clear_y[i]
+            x = clear_x[i]
+            if hashing:
+                h ^= keys[y, x, field[y, x]]
+            field[y, x] = 0
+
+        seeds, rows, h = compact_columns(field, clear_x, cleared, fell_y, fell_x, falls,
+                                            keys, hashing, h)
+        frames += rows
+
+    return chain, score, combo, frames, h
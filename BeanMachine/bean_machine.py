@@ -27,7 +27,19 @@ GO TO 2 or 4
 """
 
 import numpy as np
-import random, time
+import time
+
+from collections import OrderedDict, namedtuple
+
+from bean_kernels import (ORIENTATIONS, ORIENTATION_INDEX, ABOVE, RIGHT, BELOW, LEFT,
+                            SPAWN_STATE, PAIR_SPACES, PAIR_TRANSITIONS, MOVE_LEFT, MOVE_RIGHT,
+                            MOVE_DOWN, TURN_CCW, TURN_CW, KICK_CCW, KICK_CW, landed,
+                            flood_group, compact_columns, scatter, resolve_chain)
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
 
 #bean_colors =  {0: np.array([255, 255, 255]),   # Nothing (blank space)
 #                1: np.array([0, 0, 0]),         # Black
@@ -43,35 +55,594 @@ import random, time
 #    """
 #    return bean_colors[bean_int]
 
-# Mapping used to track how orientation of controlled bean changes with rotation
-orientation_dict = {'above':{-1:'left', 1:'right'},
-                            'below':{-1:'right', 1:'left'},
-                            'left':{-1:'below', 1:'above'},
-                            'right':{-1:'above', 1:'below'}}
+# Every distinct final placement of the controlled beans, as (column of Bean 1,
+# orientation index of Bean 2 rel. to Bean 1). Stacked pairs can go in any of 
+# the 6 columns either way up; side-by-side pairs span 5 pairs of columns.
+PLACEMENTS = ([(x, ABOVE) for x in range(6)] + [(x, BELOW) for x in range(6)] +
+                [(x, RIGHT) for x in range(5)] + [(x, LEFT) for x in range(1, 6)])
+
+# Snapshots (see BeanMachine.snapshot) are flat int64 arrays: the 78 spaces of 
+# the playing field, followed by these values.
+SNAPSHOT_STATE = ('pair_state', 'color1', 'color2', 'next1', 'next2', 'score', 'combo',
+                    'phase', 'timesteps', 'gameover', 'bean_index')
+SNAPSHOT_SIZE  = 78 + len(SNAPSHOT_STATE)
+
+# Random 64-bit keys for Zobrist hashing of the playing field, one for each 
+# color (bean type) in each space. Blank spaces hash to 0, so the hash of a 
+# field is the XOR of the keys of its beans.
+ZOBRIST_KEYS = np.random.default_rng(0x6d65616e).integers(0, 2**64, size=(13, 6, 7), 
+                                                            dtype=np.uint64)
+ZOBRIST_KEYS[:, :, 0] = 0
+ZOBRIST = ZOBRIST_KEYS.tolist()     # Same keys as Python ints, for fast updates
+
+# Events reported to listeners (see BeanMachine.subscribe), and their data:
+EVENTS = ('pair_spawned',     # bean1, bean2: [Y, X, color] of the new pair; next1, next2
+            'pair_locked',    # cells: [(Y, X)] where the pair came to rest
+            'group_cleared',  # cells: [(Y, X)] of the group (with black beans), color, combo
+            'chain_step',     # combo, cleared: beans removed in this step, points
+            'score_changed',  # score, delta
+            'game_over')      # score
+
+# Names of the game phases, by phase number (see the Game Loop above)
+PHASES = ('check_loss', 'next_bean', 'movement', 'timer', 'drop', 'postdrop',
+            'completion_check', 'remove_beans', 'completion_drop')
+
+# What happened during BeanMachine.run_until_decision:
+#   ticks:  decisions played (frame_skip, unless the game ended first)
+#   locked: pairs that came to rest
+#   combo:  most groups cleared in one of those turns
+Decision = namedtuple('Decision', ('ticks', 'locked', 'combo'))
+
+def label_colors(field):
+    """
+    Label the 4-connected groups of same-colored beans on the field. 
+    Uses scipy.ndimage when it is available.
+
+    Args:
+        field (np.ndarray): Playing field.
+
+    Returns:
+        [tuple]: (colored, black), label arrays for the colored beans 
+                    and the black beans. Blank cells are labeled 0, and 
+                    labels are unique across colors.
+    """
+    if ndimage is None:
+        from bean_machine_batch import label_groups
+        colored = label_groups(field[None], field[None] > 1)[0]
+        black   = label_groups(field[None], field[None] == 1)[0]
+        return colored, black
+
+    colored = np.zeros(field.shape, dtype=int)
+    n = 0
+    for c in range(2, 7):
+        labels, count = ndimage.label(field == c)
+        colored += np.where(labels > 0, labels + n, 0)
+        n += count
+
+    black, _ = ndimage.label(field == 1)
+
+    return colored, black
+
+def find_groups(field, seeds=()):
+    """
+    Find every complete group on the playing field in one pass.
+
+    As in BeanMachine.check_neighbors, black beans touching a group 
+    count toward it and are removed with it. A region of black beans 
+    that touches several groups belongs to the first one only: the 
+    groups of the seed beans go first (in order), then the others by 
+    their first bean, column by column from the top left (the order 
+    BitBeanMachine checks them in).
+
+    Args:
+        field (np.ndarray): Playing field.
+        seeds (list[tuple], optional): (y, x) coordinates of the beans 
+                                        that just moved. Defaults to ().
+
+    Returns:
+        [list[tuple]]: (Y-coordinates, X-coordinates) arrays for each 
+                        group of 4 or more beans.
+    """
+    colored, black = label_colors(field)
+    count = np.bincount(colored.ravel())
+
+    if not black.any():
+        return [np.nonzero(colored == label) for label in np.flatnonzero(count[1:] >= 4) + 1]
+
+    # Find every (group, black region) pair that touches
+    pairs = []
+    for a, b in ((colored[1:, :], black[:-1, :]), (colored[:-1, :], black[1:, :]),
+                    (colored[:, 1:], black[:, :-1]), (colored[:, :-1], black[:, 1:])):
+        touch = (a > 0) & (b > 0)
+        pairs.append(np.stack([a[touch], b[touch]], axis=1))
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+
+    black_count = np.bincount(black.ravel())
+
+    # Let each group claim the black regions no earlier group has
+    labels, index = np.unique(colored.T.ravel(), return_index=True)
+    labels  = labels[np.argsort(index)]
+    first   = [int(colored[y, x]) for y, x in seeds if colored[y, x] > 0]
+    order   = dict.fromkeys(first + labels[labels > 0].tolist())
+    claimed = set()
+    groups  = []
+    for label in order:
+        regions = [r for r in pairs[pairs[:, 0] == label, 1].tolist() if r not in claimed]
+        claimed.update(regions)
+
+        if count[label] + black_count[regions].sum() >= 4:
+            group = colored == label
+            if regions:
+                group |= np.isin(black, regions)
+            groups.append(np.nonzero(group))
+
+    return groups
+
+def zobrist_hash(field):
+    """
+    Zobrist hash of a playing field, computed from scratch.
+
+    Args:
+        field (np.ndarray): Playing field.
+
+    Returns:
+        [int]: 64-bit hash.
+    """
+    ys, xs = np.nonzero(field)
+    return int(np.bitwise_xor.reduce(ZOBRIST_KEYS[ys, xs, field[ys, xs]]))
+
+def resolve_chains(field, seed_cells, combo: int=0):
+    """
+    Play out the whole chain started by some beans landing, in place 
+    on a playing field: remove the complete groups they are part of, 
+    let the beans above fall, and repeat from the beans that fell. 
+    Scores as BeanMachine.remove_beans does (combo*beans cleared).
+
+    Args:
+        field (np.ndarray): Settled playing field (modified).
+        seed_cells (list[tuple]): (y, x) coordinates of the beans that 
+                                    landed.
+        combo (int, optional): Combo count before the chain. Defaults to 0.
+
+    Returns:
+        [tuple]: (links in the chain, list of beans cleared in each 
+                    link, points scored)
+    """
+    ys = np.array([y for y, _ in seed_cells], dtype=np.int64)
+    xs = np.array([x for _, x in seed_cells], dtype=np.int64)
+
+    links = np.zeros((20, 2), dtype=np.int64)
+    chain, score, _, _, _ = resolve_chain(field, ys, xs, len(ys), combo, links,
+                                            ZOBRIST_KEYS, False, np.uint64(0))
+
+    return chain, links[:chain, 1].tolist(), score
+
+def print_listener(machine, event, data):
+    """
+    Listener that reports the game's progress on stdout: the score 
+    whenever a new pair enters, every step of a chain, and Game Over.
+    """
+    if event == 'pair_spawned':
+        print(f"Score: {machine.score}")
+    elif event == 'chain_step':
+        print(f"Score: {machine.score} | Combo: {data['combo']}")
+    elif event == 'game_over':
+        print(f"Game Over | Score: {data['score']}")
+
+class TranspositionCache():
+    """
+    Bounded LRU cache of resolved chains. Maps the hash of a settled 
+    field (plus the beans that just landed on it) to the field after 
+    every chain has played out, the beans cleared by each link of the 
+    chain, the frames the chain takes and the hash of the resolved 
+    field.
+
+    One cache can be shared by any number of games, e.g. a game and 
+    the scratch machine of a planner searching it.
+    """
+
+    def __init__(self, maxsize: int=65536):
+        """
+        Instantiation
+
+        Args:
+            maxsize (int, optional): Number of entries to keep. The least 
+                                    recently used entry is dropped when 
+                                    the cache is full. Defaults to 65536.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Look up an entry, counting the hit or miss.
+
+        Returns:
+            [tuple]: The entry, or None if it is not cached.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return entry
+
+    def put(self, key, entry):
+        """
+        Add an entry, dropping the least recently used one if full.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry and zero the counters.
+        """
+        self.entries.clear()
+        self.hits   = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Hit and miss counts, for tuning the cache size.
+
+        Returns:
+            [dict]: hits, misses, hit_rate, size and maxsize.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries), 'maxsize': self.maxsize}
+
+class BeanQueue():
+    """
+    Sequence of bean colors (not including black), generated in bulk.
+
+    The sequence is split into chunks, and chunk K is drawn all at once 
+    from its own numpy.random.Generator seeded with (seed, K). The color 
+    at any position therefore depends only on the seed and the position, 
+    so one queue can be shared by many games that each read it at their 
+    own pace.
+    """
+
+    def __init__(self, seed: int=None, chunk_size: int=1024):
+        """
+        Instantiation
+
+        Args:
+            seed (int, optional): Seed of the sequence. Defaults to None, 
+                                    which picks a fresh seed from the OS.
+            chunk_size (int, optional): Number of beans generated at a time. 
+                                    Defaults to 1024.
+        """
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        self.seed       = seed
+        self.chunk_size = chunk_size
+        self.chunks     = {}   # Recently used chunks, by chunk number
+
+    def chunk(self, k: int):
+        """
+        Get chunk K of the sequence, generating it if needed.
+        """
+        chunk = self.chunks.get(k)
+        if chunk is None:
+            chunk = np.random.default_rng([self.seed, k]).integers(2, 7, self.chunk_size)
+            chunk = chunk.tolist()
+
+            # Keep only a few chunks around
+            if len(self.chunks) >= 8:
+                self.chunks.pop(next(iter(self.chunks)))
+            self.chunks[k] = chunk
+
+        return chunk
+
+    def __getitem__(self, i: int):
+        """
+        Color of the bean at position i of the sequence.
+        """
+        return self.chunk(i // self.chunk_size)[i % self.chunk_size]
+
+    def take(self, indices):
+        """
+        Colors of the beans at several positions of the sequence.
+
+        Args:
+            indices (np.ndarray): Positions in the sequence.
+
+        Returns:
+            [np.ndarray]: Integers corresponding to bean colors.
+        """
+        return np.array([self[i] for i in np.asarray(indices).tolist()], dtype=int)
+
+class HeadlessClock():
+    """
+    Simulation clock that advances game time one tick per frame 
+    without ever sleeping. Use this for training and other runs 
+    where nobody is watching the game.
+    """
+
+    def __init__(self):
+        self.ticks = 0  # Frames elapsed in game time
+
+    def tick(self):
+        """
+        Advance game time by one frame.
+        """
+        self.ticks += 1
+
+class RealTimeClock(HeadlessClock):
+    """
+    Simulation clock that paces the game for human play. Each tick 
+    waits until the next frame boundary on the wall clock, so time 
+    spent rendering or choosing actions counts toward the frame.
+    """
+
+    def __init__(self, seconds_per_frame: float=0.1):
+        """
+        Instantiation
+
+        Args:
+            seconds_per_frame (float, optional): Wall-clock length of one 
+                                    frame. Defaults to 0.1.
+        """
+        super().__init__()
+        self.seconds_per_frame = seconds_per_frame
+        self.deadline = None    # Wall-clock time at which the current frame ends
+
+    def tick(self):
+        """
+        Advance game time by one frame, sleeping until the frame ends.
+        """
+        self.ticks += 1
+
+        now = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.seconds_per_frame
+
+        delay = self.deadline - now
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Fell behind (e.g. the game was paused), so don't try to catch up
+            self.deadline = now
+
+class PhaseProfiler():
+    """
+    Instrumentation for a BeanMachine (see BeanMachine.enable_profiling): 
+    call counts, total and longest time of each phase, and how deep 
+    the chains went and how many beans they cleared.
+
+    The profiler is also an event listener, which is how it sees the 
+    turns and the chains played out phase by phase. A chain resolved 
+    in one call (or found in the cache) is reported to chain() instead, 
+    and its time counts towards completion_check.
+    """
+
+    def __init__(self):
+        self.calls       = [0]*len(PHASES)
+        self.seconds     = [0.0]*len(PHASES)
+        self.max_seconds = [0.0]*len(PHASES)
+
+        self.chain_depths   = {}    # Chain steps in a turn -> number of turns
+        self.cells_cleared  = 0
+        self.groups_cleared = 0
+
+        self.links   = 0        # Chain steps so far in the current turn
+        self.locked  = False    # Whether a pair has locked since the last turn ended
+
+    def wrap(self, index: int, phase):
+        """
+        Wrap a phase method so each call is counted and timed.
+
+        Args:
+            index (int): Phase number.
+            phase (function): Phase method.
+
+        Returns:
+            [function]: The timed phase.
+        """
+        calls       = self.calls
+        seconds     = self.seconds
+        max_seconds = self.max_seconds
+        clock       = time.perf_counter
+
+        def timed():
+            start = clock()
+            phase()
+            elapsed = clock() - start
+
+            calls[index]   += 1
+            seconds[index] += elapsed
+            if elapsed > max_seconds[index]:
+                max_seconds[index] = elapsed
+
+        return timed
+
+    def __call__(self, machine, event, data):
+        if event == 'pair_locked':
+            self.links  = 0
+            self.locked = True
+
+        elif event == 'chain_step':
+            self.links         += 1
+            self.cells_cleared += data['cleared']
+
+        elif event == 'group_cleared':
+            self.groups_cleared += 1
+
+        elif event in ('pair_spawned', 'game_over') and self.locked:
+            # The turn is over
+            self.chain_depths[self.links] = self.chain_depths.get(self.links, 0) + 1
+            self.locked = False
+
+    def chain(self, links):
+        """
+        Record a chain resolved in one call.
+
+        Args:
+            links (list): (groups, beans cleared) for each link of the chain.
+        """
+        for groups, cleared in links:
+            self.links          += 1
+            self.cells_cleared  += cleared
+            self.groups_cleared += groups
+
+    def stats(self):
+        """
+        Everything recorded so far, as plain numbers that can be 
+        pickled, saved as JSON, or combined with merge_stats.
+
+        Returns:
+            [dict]: phases: {name: {calls, seconds, max_seconds}}, 
+                    chain_depths: {depth: turns}, cells_cleared, 
+                    groups_cleared.
+        """
+        return {'phases': {name: {'calls': self.calls[i],
+                                    'seconds': self.seconds[i],
+                                    'max_seconds': self.max_seconds[i]}
+                            for i, name in enumerate(PHASES)},
+                'chain_depths': dict(self.chain_depths),
+                'cells_cleared': self.cells_cleared,
+                'groups_cleared': self.groups_cleared}
+
+def merge_stats(stats):
+    """
+    Combine profiling stats from several games (e.g. from the workers 
+    of a vector environment).
+
+    Args:
+        stats (list[dict]): Results of BeanMachine.stats().
+
+    Returns:
+        [dict]: Totals, in the same format.
+    """
+    total = PhaseProfiler().stats()
+
+    for part in stats:
+        for name, phase in part['phases'].items():
+            merged = total['phases'][name]
+            merged['calls']      += phase['calls']
+            merged['seconds']    += phase['seconds']
+            merged['max_seconds'] = max(merged['max_seconds'], phase['max_seconds'])
+
+        for depth, turns in part['chain_depths'].items():
+            depth = int(depth)  # (Keys become strings in JSON)
+            total['chain_depths'][depth] = total['chain_depths'].get(depth, 0) + turns
+
+        total['cells_cleared']  += part['cells_cleared']
+        total['groups_cleared'] += part['groups_cleared']
+
+    return total
+
+class Pair():
+    """
+    The controlled beans: their pair state (position and orientation, 
+    see bean_kernels.pair_state) and colors. Every way the pair can 
+    move is looked up in bean_kernels.PAIR_TRANSITIONS by its state.
+    """
+
+    __slots__ = ('state', 'color1', 'color2')
+
+    def __init__(self, state: int=SPAWN_STATE, color1: int=0, color2: int=0):
+        self.state  = state
+        self.color1 = color1
+        self.color2 = color2
+
+    @property
+    def orientation(self):
+        """
+        Orientation index of Bean 2 rel. to Bean 1 (see ORIENTATIONS).
+        """
+        return self.state // 78
+
+    @property
+    def bean1(self):
+        """
+        Bean 1 as [Y, X, color].
+        """
+        y1, x1, _, _ = PAIR_SPACES[self.state]
+        return [y1, x1, self.color1]
+
+    @property
+    def bean2(self):
+        """
+        Bean 2 as [Y, X, color].
+        """
+        _, _, y2, x2 = PAIR_SPACES[self.state]
+        return [y2, x2, self.color2]
 
 class BeanMachine():
 
     def __init__(self, seed: int=None, seconds_per_frame: float=0.1,
-                    frames_per_drop: int=3):
+                    frames_per_drop: int=3, headless: bool=False, clock=None,
+                    whole_board: bool=False, beans: BeanQueue=None,
+                    repeat_sequence: bool=False, cache: TranspositionCache=None,
+                    verbose: bool=False):
         """
         Instantiation
 
         Args:
-            seed (int, optional): Random seed to use. Defaults to None, 
-                                    which will not seed the random generator.
+            seed (int, optional): Seed of this game's bean sequence. Defaults 
+                                    to None, which picks a fresh seed.
             seconds_per_frame (float, optional): Seconds to pause during each frame 
                                     (NOT the exact framerate). Defaults to 0.1.
             frames_per_drop (int, optional): Number of frames to spend on the 
                                     animation when beans automatically drop. Defaults to 3.
+            headless (bool, optional): If True, advance game time without any 
+                                    wall-clock sleeps. Defaults to False.
+            clock (optional): Clock object with a tick() method, overriding the 
+                                    headless and seconds_per_frame settings. 
+                                    Defaults to None.
+            whole_board (bool, optional): If True, look for complete groups 
+                                    across the whole field in one labeling 
+                                    pass instead of starting from the beans 
+                                    that just dropped. Defaults to False.
+            beans (BeanQueue, optional): Bean sequence to play, which may be 
+                                    shared with other games. Defaults to None, 
+                                    which creates one from the seed.
+            repeat_sequence (bool, optional): If True, every reset starts the 
+                                    bean sequence over from the beginning, so 
+                                    every game gets the same beans. Defaults 
+                                    to False.
+            cache (TranspositionCache, optional): Cache of resolved chains. 
+                                    When given, the field is Zobrist hashed 
+                                    as it changes, and a chain that is in 
+                                    the cache is applied at once instead 
+                                    of being played out (skipping its 
+                                    animation frames), unless listeners 
+                                    are subscribed. Defaults to None.
+            verbose (bool, optional): If True, report the score and combos 
+                                    on stdout (see print_listener). Defaults 
+                                    to False.
         """
 
-        # Prepare random seed
-        self.seed = seed
-        random.seed(self.seed)
+        # Prepare this game's own bean sequence
+        self.beans = BeanQueue(seed) if beans is None else beans
+        self.seed  = self.beans.seed
+        self.bean_index      = 0     # Position of the next bean in the sequence
+        self.start_index     = 0     # Position of the first bean of this game
+        self.repeat_sequence = repeat_sequence
 
         # Prepare framerate controls
         self.seconds_per_frame = seconds_per_frame
         self.frames_per_drop   = frames_per_drop
+        self.whole_board       = whole_board
+
+        if clock is None:
+            clock = HeadlessClock() if headless else RealTimeClock(seconds_per_frame)
+        self.clock = clock
 
         # Set up playing field and game status trackers.
         self.field    = np.zeros((13, 6), dtype=int)
@@ -80,6 +651,20 @@ class BeanMachine():
         self.gameover = False
         self.dropping = False   # Whether the controllable beans are hard-dropping
 
+        # Set up Zobrist hashing and the chain cache
+        self.cache       = cache
+        self.hashing     = cache is not None
+        self.hash        = 0        # Zobrist hash of the field (kept up to date if hashing)
+        self.chain_start = False    # Whether the next completion check starts a chain
+        self.chain_key   = None     # Cache key of the chain being played out
+        self.chain_links = []       # (groups, beans cleared) for each link of that chain
+        self.chain_ticks = 0        # Frames that chain has taken so far
+
+        # Functions called with (machine, event, data) as the game plays out
+        self.listeners = []
+        if verbose:
+            self.subscribe(print_listener)
+
         # Set up and initialize display
         #self.display = 255*np.ones((13, 8, 3), dtype=int)
 
@@ -90,10 +675,14 @@ class BeanMachine():
         self.next2 = self.new_bean()
         self.next1 = self.new_bean()
 
+        # Controlled beans, set for real when they enter the field
+        self.pair = Pair()
+
         # Show the next beans at the top
         #self.display_next_beans()
 
         # Set up the game
+        self.profiler  = None
         self.phase_map =   {0: self.check_loss,
                             1: self.next_bean,
                             2: self.movement,
@@ -109,6 +698,20 @@ class BeanMachine():
         # Create a container for the current action. See the movement method for options.
         self.action = 0
 
+        # Buffers reused by the group detection, dropping and scatter kernels
+        self.snap    = np.zeros((13, 6), dtype=int)
+        self.group_y = np.empty(78, dtype=np.int64)
+        self.group_x = np.empty(78, dtype=np.int64)
+        self.clear_y = np.empty(78, dtype=np.int64)     # Beans to remove (as in eliminate)
+        self.clear_x = np.empty(78, dtype=np.int64)
+        self.blank   = np.zeros(78, dtype=np.int64)
+        self.cleared = 0
+        self.fell_y  = np.empty(78, dtype=np.int64)     # Beans that fell in the last drop
+        self.fell_x  = np.empty(78, dtype=np.int64)
+        self.falls   = np.empty(78, dtype=np.int64)     # Rows each of them fell
+        self.fallen  = 0
+        self.links   = np.zeros((20, 2), dtype=np.int64)   # (groups, beans cleared) per link
+
     def reset(self):
         """
         Reset the game, clearing the field and score.
@@ -117,6 +720,13 @@ class BeanMachine():
         self.score    = 0
         self.combo    = 0
         self.gameover = False
+        self.hash     = 0
+        self.chain_key = None
+        self.fallen    = 0
+
+        if self.repeat_sequence:
+            self.bean_index = 0
+        self.start_index = self.bean_index
 
         # Create the first controlled beans
         self.next2 = self.new_bean()
@@ -126,6 +736,142 @@ class BeanMachine():
         self.timesteps = 0
         self.action    = 0
 
+    def snapshot(self, out: np.ndarray=None):
+        """
+        Capture the game state that matters for decisions: the field, 
+        the controlled beans and their orientation, the next beans, 
+        score, combo, phase, timer, Game Over flag and the position 
+        in the bean sequence. (The sequence itself is not copied, so 
+        restore snapshots into games that play the same BeanQueue.)
+
+        Snapshots are meant to be taken between steps while the game 
+        waits for an action (phases 1 and 2). The bookkeeping of chains 
+        in progress (phases 5-8) is not captured.
+
+        Args:
+            out (np.ndarray, optional): int64 array of SNAPSHOT_SIZE entries 
+                                    to write into, e.g. a row of a 
+                                    preallocated (N, SNAPSHOT_SIZE) array. 
+                                    Defaults to None, which allocates one.
+
+        Returns:
+            [np.ndarray]: The snapshot.
+        """
+        if out is None:
+            out = np.empty(SNAPSHOT_SIZE, dtype=np.int64)
+
+        pair = self.pair
+
+        out[:78] = self.field.reshape(78)
+        out[78:] = (pair.state, pair.color1, pair.color2, self.next1, self.next2,
+                    self.score, self.combo, self.phase, self.timesteps, self.gameover,
+                    self.bean_index)
+
+        return out
+
+    def restore(self, snap: np.ndarray):
+        """
+        Return the game to the state captured in a snapshot.
+
+        Args:
+            snap (np.ndarray): Snapshot from BeanMachine.snapshot.
+        """
+        self.field[:] = snap[:78].reshape(13, 6)
+        if self.hashing:
+            self.rehash()
+
+        pair = self.pair
+        item = snap.item
+
+        pair.state, pair.color1, pair.color2 = item(78), item(79), item(80)
+
+        self.next1      = item(81)
+        self.next2      = item(82)
+        self.score      = item(83)
+        self.combo      = item(84)
+        self.phase      = item(85)
+        self.timesteps  = item(86)
+        self.gameover   = bool(item(87))
+        self.bean_index = item(88)
+        self.action     = 0
+        self.chain_key  = None
+
+    def subscribe(self, listener):
+        """
+        Start reporting game events to a listener. Events are only 
+        built while at least one listener is subscribed, so a game 
+        with no listeners pays nothing for them.
+
+        Args:
+            listener (function): Called as listener(machine, event, data), 
+                                    where event is one of EVENTS and data 
+                                    is a dict (see EVENTS).
+
+        Returns:
+            [function]: The listener, so this can be used as a decorator.
+        """
+        self.listeners.append(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        """
+        Stop reporting game events to a listener.
+        """
+        self.listeners.remove(listener)
+
+    def emit(self, event, **data):
+        """
+        Report an event to every listener. Callers check that there 
+        are listeners first, so that no data is built without them.
+        """
+        for listener in self.listeners:
+            listener(self, event, data)
+
+    def enable_profiling(self):
+        """
+        Start recording per-phase call counts and timings, chain depths 
+        and beans cleared (see PhaseProfiler). Only the phase methods 
+        are wrapped, so a game without profiling runs exactly as fast 
+        as before. Chains are still resolved in one call (or taken from 
+        the cache) while profiling is on, so completion_check's time 
+        includes the whole chain's.
+
+        Returns:
+            [PhaseProfiler]: The profiler.
+        """
+        if self.profiler is None:
+            self.profiler  = PhaseProfiler()
+            self.phase_map = {i: self.profiler.wrap(i, getattr(self, name))
+                                for i, name in enumerate(PHASES)}
+            self.subscribe(self.profiler)
+
+        return self.profiler
+
+    def disable_profiling(self):
+        """
+        Stop profiling and discard what was recorded.
+        """
+        if self.profiler is not None:
+            self.unsubscribe(self.profiler)
+            self.phase_map = {i: getattr(self, name) for i, name in enumerate(PHASES)}
+            self.profiler  = None
+
+    def stats(self):
+        """
+        Profiling results so far (see PhaseProfiler.stats).
+
+        Returns:
+            [dict]: The stats, or None if profiling is off.
+        """
+        return None if self.profiler is None else self.profiler.stats()
+
+    def rehash(self):
+        """
+        Recompute the Zobrist hash of the field from scratch. Call this 
+        after changing the field directly instead of through bean_change.
+        """
+        self.hash = zobrist_hash(self.field)
+
     def step(self):
         """
         Take the next gameplay step. To be called by OpenAI Gym environments.
@@ -134,14 +880,70 @@ class BeanMachine():
             phase = self.phase_map[self.phase]
             phase()
 
+    def run_until_decision(self, action: int=0, frame_skip: int=1):
+        """
+        Apply an action and play the game until the agent must act again: 
+        the next time it waits for movement (Phase 2), or Game Over. 
+        (If it starts on Phase 2, go until the NEXT time.) This is one 
+        BeanGymEnv step, in a single call.
+
+        Args:
+            action (int, optional): Action to take (see movement). Defaults to 0.
+            frame_skip (int, optional): Number of decisions to repeat the 
+                                    action for, stopping early at Game Over. 
+                                    Defaults to 1.
+
+        Returns:
+            [tuple]: (reward, done, info), where reward is the change in 
+                        score, done is the Game Over flag and info is a 
+                        Decision.
+        """
+        phase_map = self.phase_map
+        score     = self.score
+        locked    = 0
+        combo     = 0
+        ticks     = 0
+
+        while ticks < frame_skip and not self.gameover:
+            self.action = action
+            ticks      += 1
+
+            while True:
+                phase = self.phase
+                if phase == 0 and self.combo > combo:
+                    combo = self.combo  # (About to be reset by check_loss)
+                elif phase == 5:
+                    locked += 1         # (Every pair comes to rest in postdrop)
+
+                phase_map[phase]()
+                if self.gameover or self.phase == 2: break
+
+        self.action = 0     # Reset action
+
+        return (self.score - score, self.gameover,
+                Decision(ticks, locked, combo))
+
+    def reseed(self, seed: int=None):
+        """
+        Switch to a new bean sequence, starting from its beginning.
+
+        Args:
+            seed (int, optional): Seed of the new sequence. Defaults to None, 
+                                    which picks a fresh seed.
+        """
+        self.beans      = BeanQueue(seed)
+        self.seed       = self.beans.seed
+        self.bean_index = 0
+
     def new_bean(self):
         """
-        Randomly select a new bean color. (Does not include black)
+        Take the next bean color from the bean sequence. (Does not include black)
 
         Returns:
             [int]: Integer corresponding to a bean color (see bean_colors dict).
         """
-        return random.randint(2,6)
+        self.bean_index += 1
+        return self.beans[self.bean_index-1]
 
     def display_next_beans(self):
         """
@@ -168,11 +970,12 @@ class BeanMachine():
         topval = max(self.field[0, :])
 
         # Reset combo counter
-        print(f"Score: {self.score} | Combo: {self.combo}")
         self.combo = 0
 
         if topval != 0:
             self.gameover = True
+            if self.listeners:
+                self.emit('game_over', score=self.score)
 
         self.phase += 1
 
@@ -189,11 +992,44 @@ class BeanMachine():
             X = x-coordinate of pixel to change
             C = New color (bean type) of pixel
         """
-        while len(change_list) > 0:
-            y, x, c = change_list.pop(0)
-            self.field[y, x] = c
-            #color = get_color(c)
-            #self.display[y, x, :] = color
+        field = self.field
+
+        if self.hashing:
+            # XOR out the old bean and XOR in the new one
+            h = self.hash
+            for y, x, c in change_list:
+                keys = ZOBRIST[y][x]
+                h ^= keys[field.item(y, x)] ^ keys[c]
+                field[y, x] = c
+            self.hash = h
+
+        else:
+            for y, x, c in change_list:
+                field[y, x] = c
+
+        change_list.clear()
+
+    def scatter(self, ys, xs, colors, n: int=None):
+        """
+        Change many spaces of the field at once, given as arrays. The 
+        changes are applied in order in one compiled pass, so (as with 
+        bean_change) the last change to a space wins, and the Zobrist 
+        hash is updated in the same pass.
+
+        Args:
+            ys, xs (np.ndarray): int64 coordinates of the spaces to change.
+            colors (np.ndarray): int64 new color of each space.
+            n (int, optional): Number of changes to apply, from the start 
+                                of the arrays. Defaults to None, which 
+                                applies them all.
+        """
+        if n is None:
+            n = len(ys)
+
+        h = scatter(self.field, ys, xs, colors, n, ZOBRIST_KEYS, self.hashing, 
+                    np.uint64(self.hash))
+        if self.hashing:
+            self.hash = int(h)
 
     def next_bean(self):
         """
@@ -202,13 +1038,18 @@ class BeanMachine():
         change_list = [(0, 3, self.next2), (1, 3, self.next1)]
         self.bean_change(change_list)
 
-        self.orientation = 'above'  # Placement of Bean 2 rel. to Bean 1
-        self.bean2     = [0, 3, self.next2]
-        self.bean1    = [1, 3, self.next1]
+        pair        = self.pair
+        pair.state  = SPAWN_STATE   # Bean 2 above Bean 1
+        pair.color1 = self.next1
+        pair.color2 = self.next2
 
         self.next2 = self.new_bean()
         self.next1 = self.new_bean()
 
+        if self.listeners:
+            self.emit('pair_spawned', bean1=pair.bean1, bean2=pair.bean2,
+                        next1=self.next1, next2=self.next2)
+
         self.display_next_beans()
         self.phase += 1
 
@@ -246,24 +1087,85 @@ class BeanMachine():
         # Move to next phase
         self.phase += 1
 
-    def move_update(self, x1, y1, x2, y2):
+    def place(self, column: int, orientation: int):
+        """
+        Steer the controllable beans to a final placement and drop them 
+        all the way down, then play out the rest of the turn: settling, 
+        any chains, the loss check and the next pair. Must be called 
+        while the game is waiting for movement (phase 2). Does nothing 
+        after Game Over.
+
+        The beans are rotated and moved the same way a player would move 
+        them, so a placement that is blocked off ends wherever the beans 
+        get stuck. Every space dropped scores a hard-drop point.
+
+        Args:
+            column (int): Column to put Bean 1 in.
+            orientation (int): Orientation index of Bean 2 rel. to Bean 1 
+                                (or its name, see ORIENTATIONS).
+        """
+        if self.gameover:
+            return
+
+        if isinstance(orientation, str):
+            orientation = ORIENTATION_INDEX[orientation]
+
+        # Rotate the short way round
+        turns = (orientation - self.pair.orientation) % 4
+        if turns == 3:
+            _ = self.rotate(-1)
+        for _ in range(turns % 3):
+            _ = self.rotate(1)
+
+        while True:
+            x1 = PAIR_SPACES[self.pair.state][1]
+            if x1 == column or self.move(1 if column > x1 else -1) == 0:
+                break
+
+        self.dropping = True
+        while self.hard_drop() == 1:
+            pass
+        self.dropping = False
+
+        # Drop checks for contact, then the turn plays out until the next pair is in control
+        self.phase = 4
+        _ = self.run_until_decision()
+
+    def shift_pair(self, step):
+        """
+        Move the controlled beans by a pair transition (an entry of 
+        bean_kernels.PAIR_TRANSITIONS), if the spaces it needs are free.
+
+        Returns:
+            [int]: 0 for failed movement (blocked by other beans or 
+                    field boundaries). 1 for successful movement.
+        """
+        if step is None:
+            return 0
+
+        state, ya, xa, yb, xb, left = step
+        field = self.field
+        if field.item(ya, xa) or field.item(yb, xb):
+            return 0
+
+        self.set_pair(state, left)
+
+        return 1
+
+    def set_pair(self, state, left):
         """
-        Update the field and display when the controlled beans
-        move to positions (x1,y1) and (x2,y2).
+        Update the field when the controlled beans move to a new pair 
+        state, emptying the spaces (Y, X) in left that they move out of.
         """
-        # Clear old pixels
-        change_1 = [self.bean1[0], self.bean1[1], 0]
-        change_2 = [self.bean2[0], self.bean2[1], 0]
-        # Change new pixels
-        change_3 = [y2, x2, self.bean2[2]]
-        change_4 = [y1, x1, self.bean1[2]]
-        change_list = [change_1, change_2, change_3, change_4]
+        pair = self.pair
+        y1, x1, y2, x2 = PAIR_SPACES[state]
+
+        change_list = [(y, x, 0) for y, x in left]
+        change_list.append((y2, x2, pair.color2))
+        change_list.append((y1, x1, pair.color1))
         self.bean_change(change_list)
 
-        self.bean2[1] = x2
-        self.bean2[0] = y2
-        self.bean1[1] = x1
-        self.bean1[0] = y1
+        pair.state = state
 
     def move(self, direction: int):
         """
@@ -276,31 +1178,9 @@ class BeanMachine():
             [int]: 0 for failed movement (blocked by other beans or 
                     field boundaries). 1 for successful movement.
         """
-        # See what the hypothetical new coordinates would be
-        y2 = self.bean2[0]
-        x2 = self.bean2[1]+direction
-        y1 = self.bean1[0]
-        x1 = self.bean1[1]+direction
+        moves = PAIR_TRANSITIONS[MOVE_RIGHT if direction > 0 else MOVE_LEFT]
 
-        if min([x1, x2]) < 0:
-            return 0
-
-        if max([x1, x2]) > 5:
-            return 0
-
-        if y1==y2:
-            x = direction*max([direction*x1, direction*x2])
-            if self.field[y1, x] > 0:
-                return 0
-        else:
-            if self.field[y1, x1] > 0:
-                return 0
-            if self.field[y2, x2] > 0:
-                return 0
-
-        self.move_update(x1, y1, x2, y2)
-
-        return 1
+        return self.shift_pair(moves[self.pair.state])
 
     def rotate(self, direction: int):
         """
@@ -317,47 +1197,13 @@ class BeanMachine():
             [int]: 0 for failed movement (blocked by other beans or 
                     field boundaries). 1 for successful movement.
         """
+        state = self.pair.state
+        if direction > 0:
+            turn, kick = PAIR_TRANSITIONS[TURN_CW], PAIR_TRANSITIONS[KICK_CW]
+        else:
+            turn, kick = PAIR_TRANSITIONS[TURN_CCW], PAIR_TRANSITIONS[KICK_CCW]
 
-        y1 = self.bean1[0]
-        x1 = self.bean1[1]
-
-        if self.orientation == 'above':
-            y2 = self.bean2[0]+1
-            x2 = self.bean2[1]+direction
-            y1m = self.bean1[0]
-            x1m = self.bean1[1]-direction
-        if self.orientation == 'below':
-            y2 = self.bean2[0]-1
-            x2 = self.bean2[1]-direction
-            y1m = self.bean1[0]
-            x1m = self.bean1[1]+direction
-        if self.orientation == 'left':
-            y2 = self.bean2[0]-direction
-            x2 = self.bean2[1]+1
-            y1m = self.bean1[0]+direction
-            x1m = self.bean1[1]
-        if self.orientation == 'right':
-            y2 = self.bean2[0]+direction
-            x2 = self.bean2[1]-1
-            y1m = self.bean1[0]-direction
-            x1m = self.bean1[1]
-
-        # Check for collision on Bean 2
-        if (x2 < 0) or (x2 > 5) or (y2 < 0) or (y2 > 12) or (self.field[y2,x2] > 0):
-            # Check if Bean 1 can move away
-            if self.field[y1m, x1m] > 0:
-                return 0
-            else:
-                x2 = x1
-                y2 = y1
-                y1 = y1m
-                x1 = x1m 
-
-        self.move_update(x1, y1, x2, y2)
-
-        self.orientation = orientation_dict[self.orientation][direction]
-
-        return 1
+        return self.shift_pair(turn[state]) or self.shift_pair(kick[state])
 
     def hard_drop(self):
         """
@@ -367,37 +1213,24 @@ class BeanMachine():
         Returns:
             [int]: 1 if the movement succeeds, otherwise 0.
         """
-        y2 = self.bean2[0]+1
-        x2 = self.bean2[1]
-        y1 = self.bean1[0]+1
-        x1 = self.bean1[1]
-
-        if max([y1, y2]) > 12:
+        if not self.shift_pair(PAIR_TRANSITIONS[MOVE_DOWN][self.pair.state]):
             return 0
 
-        if x1 == x2:
-            y = max([y1, y2])
-            if self.field[y, x1] > 0:
-                return 0
-        else:
-            if (self.field[y1,x1] > 0) or (self.field[y2,x2] > 0):
-                return 0
-
-        self.move_update(x1, y1, x2, y2)
-
         if self.dropping:
             # You get a point for hard dropping successfully!
             self.score += 1
+            if self.listeners:
+                self.emit('score_changed', score=self.score, delta=1)
 
         return 1
 
     def timer(self):
         """
-        Pause the game according to the specified framerate. If 
-        beans are in the middle of automatically dropping, wait 
-        the specified number of frames before moving them.
+        Advance the game clock by one frame. If beans are in the 
+        middle of automatically dropping, wait the specified number 
+        of frames before moving them.
         """
-        time.sleep(self.seconds_per_frame)
+        self.clock.tick()
         self.timesteps += 1
 
         if self.timesteps == self.frames_per_drop:
@@ -418,20 +1251,15 @@ class BeanMachine():
         else:
             self.phase = 2
 
-    def dropcheck(self, bean):
+    def dropcheck(self, y, x):
         """
-        Given a bean tuple (Y, X, color), check if it 
-        can be dropped one space down without collision.
-
-        Args:
-            bean ([tuple]): (Y-coordinate, X-coordinate, Color) of bean.
+        Check if the bean at (x,y) can be dropped one space down 
+        without collision.
 
         Returns:
             [bool]: False if the bean CAN drop, otherwise True.
         """
-        y = bean[0]
-        x = bean[1]
-        return ((y+1)>12) or (self.field[y+1,x]>0)
+        return landed(self.field, y, x)
 
     def postdrop(self):
         """
@@ -440,26 +1268,33 @@ class BeanMachine():
         flag1 = True
         flag2 = True
 
-        x1 = self.bean1[1]
-        x2 = self.bean2[1]
-        y1 = self.bean1[0]
-        y2 = self.bean2[0]
+        # The beans may come apart here, so they are moved one by one and 
+        # the pair state is left as it was when they landed
+        pair = self.pair
+        y1, x1, y2, x2 = PAIR_SPACES[pair.state]
 
         while flag1 or flag2:
-            if flag1 and not self.dropcheck(self.bean1):
+            old1, old2 = y1, y2
+
+            if flag1 and not self.dropcheck(y1, x1):
                 y1 += 1
             else:
                 flag1 = False
 
-            if flag2 and not self.dropcheck(self.bean2):
+            if flag2 and not self.dropcheck(y2, x2):
                 y2 += 1
             else:
                 flag2 = False
 
-            time.sleep(self.seconds_per_frame)
-            self.move_update(x1, y1, x2, y2)
+            self.clock.tick()
+            self.bean_change([(old1, x1, 0), (old2, x2, 0),
+                                (y2, x2, pair.color2), (y1, x1, pair.color1)])
+
+        self.dropped_yx  = [(y1, x1), (y2, x2)]
+        self.chain_start = True
 
-        self.dropped_yx = [(y1, x1), (y2, x2)]
+        if self.listeners:
+            self.emit('pair_locked', cells=list(self.dropped_yx))
 
         self.phase += 1
 
@@ -469,20 +1304,130 @@ class BeanMachine():
         more neighbors.
         """
 
+        if self.chain_start:
+            self.chain_start = False
+            # (Listeners are told about every group, so play the chain out for
+            #  them. The profiler is told about the chain's links instead.)
+            if not self.listeners or self.listeners == [self.profiler]:
+                if self.cache is not None and self.lookup_chain():
+                    return
+                if not self.whole_board:
+                    self.resolve_chain()
+                    return
+
         # Create a list of beans to erase because they've formed complete groups
+        # (also kept as arrays in clear_y and clear_x for remove_beans)
         self.eliminate = []
+        self.cleared   = 0
+        combo = self.combo
+
+        if self.whole_board:
+            # Label the entire field at once
+            for ys, xs in find_groups(self.field, self.dropped_yx):
+                self.eliminate += zip(ys.tolist(), xs.tolist())
+                self.combo     += 1
+                self.add_cleared(ys, xs, len(ys))
+
+                if self.listeners:
+                    self.emit('group_cleared', cells=list(zip(ys.tolist(), xs.tolist())),
+                                color=int(self.field[ys, xs].max()), combo=self.combo)
+
+        else:
+            # Take a snapshot of the playing field's current state
+            self.snap[:] = self.field
 
-        # Take a snapshot of the playing field's current state
-        self.snap = self.field.copy()
+            # Check ONLY the beans that have just dropped to 
+            # see if they have just formed a complete group.
+            for y,x in self.dropped_yx:
+                self.completion_single(x, y)
 
-        # Check ONLY the beans that have just dropped to 
-        # see if they have just formed a complete group.
-        for y,x in self.dropped_yx:
-            self.completion_single(x, y)
+        if self.chain_key is not None and len(self.eliminate) > 0:
+            self.chain_links.append((self.combo - combo, len(self.eliminate)))
 
         self.dropped_yx = []    # Reset list of dropped beans
         self.phase += 1         # Move onto the next phase
 
+    def lookup_chain(self):
+        """
+        Look up the chain that starts from the settled field in the 
+        cache. On a hit, jump straight to the resolved field and add 
+        the chain's score. On a miss, start recording the chain so it 
+        can be cached once it has played out.
+
+        Returns:
+            [bool]: True on a hit.
+        """
+        key   = (self.hash,) + tuple(self.dropped_yx)
+        entry = self.cache.get(key)
+
+        if entry is None:
+            self.chain_key   = key
+            self.chain_links = []
+            self.chain_ticks = 0
+            return False
+
+        field, links, frames, self.hash = entry
+        if field is not None:
+            self.field[:] = field
+
+        for groups, cleared in links:
+            self.combo += groups
+            self.score += self.combo*cleared
+
+        if self.profiler is not None:
+            self.profiler.chain(links)
+
+        # The clock ticks as often as it did when the chain played out
+        for _ in range(frames):
+            self.clock.tick()
+
+        self.eliminate  = []
+        self.cleared    = 0
+        self.fallen     = 0
+        self.dropped_yx = []
+        self.phase      = 0
+
+        return True
+
+    def resolve_chain(self):
+        """
+        Play out the whole chain started by the beans that just landed 
+        in one call (see resolve_chains), instead of going through 
+        phases 6-8 once per link. The clock ticks as often as it would 
+        have in those phases.
+        """
+        n = len(self.dropped_yx)
+        for i, (y, x) in enumerate(self.dropped_yx):
+            self.fell_y[i] = y
+            self.fell_x[i] = x
+
+        chain, points, self.combo, frames, h = resolve_chain(self.field, self.fell_y, self.fell_x,
+                                                                n, self.combo, self.links,
+                                                                ZOBRIST_KEYS, self.hashing,
+                                                                np.uint64(self.hash))
+        self.score += points
+        if self.hashing:
+            self.hash = int(h)
+
+        for _ in range(frames):
+            self.clock.tick()
+
+        if self.profiler is not None:
+            self.profiler.chain(self.links[:chain].tolist())
+
+        # Cache how the chain turned out (see lookup_chain)
+        if self.chain_key is not None:
+            links = tuple(map(tuple, self.links[:chain].tolist()))
+            field = self.field.copy() if chain else None
+            self.cache.put(self.chain_key, (field, links, frames, self.hash))
+            self.chain_key = None
+
+        self.eliminate  = []
+        self.cleared    = 0
+        self.fallen     = 0     # (No drop frames are kept for the chain)
+        self.dropped_yx = []
+        self.phase      = 0
+
     def completion_single(self, x, y):
         """
         Check a single bean to see if it is part of a complete group.
@@ -493,90 +1438,62 @@ class BeanMachine():
         """
         c = self.snap[y,x]   # Snapshot of playing field before removing beans
 
-        self.count  = 0     # Number of beans in group
-        self.coords = []    # Coordinates of beans in group
-        
         if c > 1:
-            self.check_neighbors(x, y, c)
+            count = self.check_neighbors(x, y)
 
-        if self.count >= 4:
-            self.eliminate += self.coords
-            self.combo     += 1
+            if count >= 4:
+                self.eliminate += zip(self.group_y[:count].tolist(), self.group_x[:count].tolist())
+                self.combo     += 1
+                self.add_cleared(self.group_y, self.group_x, count)
 
-    def check_neighbors(self, x, y, c):
+                if self.listeners:
+                    self.emit('group_cleared', cells=self.eliminate[-count:], color=int(c),
+                                combo=self.combo)
+
+    def add_cleared(self, ys, xs, count):
+        """
+        Append the first count coordinates of a group to clear_y and 
+        clear_x. (No bean belongs to two groups, so they never fill up.)
+        """
+        n = self.cleared
+        self.clear_y[n:n+count] = ys[:count]
+        self.clear_x[n:n+count] = xs[:count]
+        self.cleared = n + count
+
+    def check_neighbors(self, x, y):
         """
-        Check if the given bean has neighbors of the same color. This 
-        method will recurse until it has found all connected beans 
-        with the same color (a "group").
+        Find all beans connected to the given bean that have the same 
+        color (a "group"), plus any black beans touching the group. 
+        The search is iterative, and every bean it finds is blanked 
+        out of the snapshot so it is not counted twice.
 
         Args:
             x ([int]): x-coordinate of bean
             y ([int]): y-coordinate of bean
-            c ([int]): color of bean
-        """
-        c1 = 0
-        c2 = 0
-        c3 = 0
-        c4 = 0
-
-        # Set this bean's color in the snapshot to "Blank"
-        # to prevent double-counting
-        self.snap[y, x] = 0
-
-        # Add this bean to the current group
-        self.count += 1
-        self.coords.append((y,x))
-
-        # Check lower neighbor
-        y1 = y-1
-        if y1 >= 0:
-            c1 = self.snap[y1, x]
-            if c1 == c: self.check_neighbors(x, y1, c)
-            if c1 == 1: self.check_neighbors(x, y1, -1)
-        
-        # Check upper neighbor
-        y2 = y+1
-        if y2 <= 12:
-            c2 = self.snap[y2, x]
-            if c2 == c: self.check_neighbors(x, y2, c)
-            if c2 == 1: self.check_neighbors(x, y2, -1)
-
-        # Check left neighbor
-        x3 = x-1
-        if x3 >= 0:
-            c3 = self.snap[y, x3]
-            if c3 == c: self.check_neighbors(x3, y, c)
-            if c3 == 1: self.check_neighbors(x3, y, -1)
-
-        # Check right neighbor
-        x4 = x+1
-        if x4 <= 5:
-            c4 = self.snap[y, x4]
-            if c4 == c: self.check_neighbors(x4, y, c)
-            if c4 == 1: self.check_neighbors(x4, y, -1)
+
+        Returns:
+            [int]: Number of beans in the group. Their coordinates are 
+                    the first entries of self.group_y and self.group_x.
+        """
+        return flood_group(self.snap, y, x, self.group_y, self.group_x)
 
     def remove_beans(self):
         """
-        Remove any beans that are part of a completed group, and 
-        find any beans that need to drop because spaces beneath 
-        them have opened up.
+        Remove any beans that are part of a completed group.
         """
-        change_list   = []  # Spaces to change.
-        self.droplist = {}  # Beans to drop.
+        n = len(self.eliminate)
+        self.fallen = 0     # (The last drop's frames no longer match the field)
 
-        for (y,x) in self.eliminate:
-            change = [y, x, 0]
-            change_list.append(change)
+        points      = self.combo*n
+        self.score += points
 
-            if x not in self.droplist:
-                self.droplist[x] = [y,]
-            else:
-                self.droplist[x].append(y)
-
-        self.score += self.combo*len(self.eliminate)
+        if self.listeners and points > 0:
+            self.emit('chain_step', combo=self.combo, cleared=n, points=points)
+            self.emit('score_changed', score=self.score, delta=points)
 
-        self.bean_change(change_list)
-        time.sleep(self.seconds_per_frame)
+        self.scatter(self.clear_y, self.clear_x, self.blank, self.cleared)
+        self.clock.tick()
+        self.chain_ticks += 1
 
         self.phase += 1
 
@@ -585,45 +1502,59 @@ class BeanMachine():
         Drop any beans that have open spaces somewhere below them 
         after beans have been removed from the field.
         """
-        if len(self.droplist) == 0:
+        if self.cleared == 0:
             self.phase = 0
 
+            # The chain is over, so cache how it turned out
+            if self.chain_key is not None:
+                field = self.field.copy() if self.chain_links else None
+                self.cache.put(self.chain_key, (field, tuple(self.chain_links),
+                                                self.chain_ticks, self.hash))
+                self.chain_key = None
+
         else:
-            columns = list(self.droplist.keys())
-            for column in columns:
-                self.droplist[column] = sorted(self.droplist[column])
-
-            while len(self.droplist) > 0:
-                # Find all beans that need to drop at least one space
-                droppers = []
-                for column in columns:
-                    if column not in self.droplist:
-                        continue
-                    
-                    hi_row = self.droplist[column].pop(0)
-
-                    for row in range(0, hi_row):
-                        c = self.field[row, column]
-
-                        if c != 0:
-                            droppers.append((row, column, c))
-
-                    if len(self.droplist[column]) == 0:
-                        _ = self.droplist.pop(column)
-
-                # Drop those beans one space
-                change_list = []
-                for y,x,c in droppers[::-1]:   # Drop beans from bottom to top
-
-                    change_1 = [y, x, 0]
-                    change_2 = [y+1, x, c]
-                    change_list.append(change_1)
-                    change_list.append(change_2)
-                    self.dropped_yx.append([y+1, x])
-
-                if len(change_list) > 0:
-                    self.bean_change(change_list)
-                    time.sleep(self.seconds_per_frame)
+            # Compact the columns that lost beans, in one pass each
+            n, rows, h = compact_columns(self.field, self.clear_x, self.cleared,
+                                            self.fell_y, self.fell_x, self.falls,
+                                            ZOBRIST_KEYS, self.hashing, np.uint64(self.hash))
+            if self.hashing:
+                self.hash = int(h)
+
+            # Only the beans that fell can have formed new groups
+            self.fallen     = n
+            self.dropped_yx = list(zip(self.fell_y[:n].tolist(), self.fell_x[:n].tolist()))
+
+            # One frame per row fallen (see drop_frames)
+            for _ in range(rows):
+                self.clock.tick()
+            self.chain_ticks += rows
 
             # Now that new beans have dropped, check for completion again
-            self.phase = 6
\ No newline at end of file
+            self.phase = 6
+
+    def drop_frames(self):
+        """
+        Frames for animating the last completion drop, with the beans 
+        falling one row per frame. They are only built when asked for, 
+        from the beans that fell, so use them before the game moves on.
+
+        Yields:
+            [np.ndarray]: (13, 6) playing field of each frame. The last 
+                            one is the field after the drop.
+        """
+        n = self.fallen
+        if n == 0:
+            return
+
+        ys     = self.fell_y[:n]
+        xs     = self.fell_x[:n]
+        falls  = self.falls[:n]
+        colors = self.field[ys, xs]
+
+        base = self.field.copy()
+        base[ys, xs] = 0
+
+        for row in range(1, int(falls.max()) + 1):
+            frame = base.copy()
+            frame[ys - falls + np.minimum(falls, row), xs] = colors
+            yield frame
\ No newline at end of file
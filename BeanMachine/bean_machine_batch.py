@@ -0,0 +1,457 @@
+"""
+bean_machine_batch.py
+
+Author: MCK
+
+Vectorized counterpart of the BeanMachine that plays N games
+at once. The playing fields of every game are stored in one
+(N, 13, 6) array, and each part of the game loop (movement,
+rotation, dropping, gravity, group detection and scoring) is
+applied across the batch axis with NumPy operations instead
+of per-cell Python logic.
+
+One call to BeanMachineBatch.step() advances every game by
+one decision, exactly like one BeanGymEnv.step() call on a
+single BeanMachine: the action is applied, the timer ticks,
+and if the controlled beans lock in place the whole chain is
+resolved and the next pair is spawned. Finished games are
+reset automatically.
+
+Each game reads its beans from a BeanQueue, either its own
+(seeded like a lone BeanMachine, giving the same sequence) or
+one queue shared by every game.
+"""
+
+import numpy as np
+
+from bean_machine import BeanQueue
+
+from bean_kernels import (SPAWN_STATE, PAIR_CELLS, PAIR_STEPS, MOVE_LEFT, MOVE_RIGHT,
+                            MOVE_DOWN, TURN_CCW, TURN_CW, KICK_CCW, KICK_CW)
+
+def label_groups(field, colors):
+    """
+    Label the 4-connected groups of same-colored beans on a batch
+    of playing fields.
+
+    Args:
+        field (np.ndarray): (N, 13, 6) array of bean colors.
+        colors (np.ndarray): (N, 13, 6) boolean mask of cells to label.
+
+    Returns:
+        [np.ndarray]: (N, 13, 6) array of labels. Cells outside the mask
+                        are 0, and connected cells share the same label.
+    """
+    labels = np.where(colors, np.arange(1, 79).reshape(13, 6), 0)
+
+    # Pairs of neighboring cells that belong to the same group
+    same_v = colors[:, 1:, :] & (field[:, 1:, :] == field[:, :-1, :])
+    same_h = colors[:, :, 1:] & (field[:, :, 1:] == field[:, :, :-1])
+
+    # Spread the highest label through each group until nothing changes
+    while True:
+        new = labels.copy()
+        np.maximum(new[:, 1:, :], np.where(same_v, new[:, :-1, :], 0), out=new[:, 1:, :])
+        np.maximum(new[:, :-1, :], np.where(same_v, new[:, 1:, :], 0), out=new[:, :-1, :])
+        np.maximum(new[:, :, 1:], np.where(same_h, new[:, :, :-1], 0), out=new[:, :, 1:])
+        np.maximum(new[:, :, :-1], np.where(same_h, new[:, :, 1:], 0), out=new[:, :, :-1])
+
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+def find_clears(field, seeds):
+    """
+    Find the beans to remove from a batch of playing fields.
+
+    A group is cleared if it contains at least one seed cell and has
+    4 or more beans. As in BeanMachine.check_neighbors, any connected
+    region of black beans touching a group is counted as part of it
+    and removed with it. (Black beans never spawn in normal play. Unlike
+    BeanMachine, if one black region touches two groups, it counts
+    toward both: the seeds of a batch have no order to settle which.)
+
+    Args:
+        field (np.ndarray): (N, 13, 6) array of bean colors.
+        seeds (np.ndarray): (N, 13, 6) boolean mask of beans that have
+                            just moved and should be checked.
+
+    Returns:
+        [tuple]: (clear, groups), where clear is an (N, 13, 6) boolean
+                    mask of beans to remove and groups is an (N,) array
+                    with the number of groups cleared on each field.
+    """
+    n = field.shape[0]
+    offset = (np.arange(n)*79).reshape(n, 1, 1)  # Make labels unique across boards
+
+    colored = field > 1
+    black   = field == 1
+
+    cid = np.where(colored, label_groups(field, colored) + offset, 0)
+    bid = np.where(black, label_groups(field, black) + offset, 0)
+
+    count = np.bincount(cid[colored], minlength=n*79)
+
+    # Find every (group, black region) pair that touches
+    pairs = []
+    if black.any():
+        for a, b in ((cid[:, 1:, :], bid[:, :-1, :]), (cid[:, :-1, :], bid[:, 1:, :]),
+                        (cid[:, :, 1:], bid[:, :, :-1]), (cid[:, :, :-1], bid[:, :, 1:])):
+            touch = (a > 0) & (b > 0)
+            pairs.append(np.stack([a[touch], b[touch]], axis=1))
+        pairs = np.unique(np.concatenate(pairs), axis=0)
+        black_count = np.bincount(bid[black], minlength=n*79)
+        np.add.at(count, pairs[:, 0], black_count[pairs[:, 1]])
+
+    # Groups that contain a seed and are big enough
+    checked = np.unique(cid[seeds & colored])
+    cleared = checked[count[checked] >= 4]
+
+    clear = colored & np.isin(cid, cleared)
+    if len(pairs) > 0:
+        clear |= black & np.isin(bid, pairs[np.isin(pairs[:, 0], cleared), 1])
+
+    groups = np.bincount(cleared // 79, minlength=n)
+
+    return clear, groups
+
+def settle(field):
+    """
+    Drop every bean straight down into the lowest open space of its
+    column, keeping the order of beans within each column.
+
+    Args:
+        field (np.ndarray): (N, 13, 6) array of bean colors.
+
+    Returns:
+        [tuple]: (field, moved), the settled (N, 13, 6) field and a
+                    boolean mask of the new positions of beans that moved.
+    """
+    order = np.argsort(field != 0, axis=1, kind='stable')
+    field = np.take_along_axis(field, order, axis=1)
+    moved = (order != np.arange(13).reshape(1, 13, 1)) & (field != 0)
+
+    return field, moved
+
+class BeanMachineBatch():
+
+    def __init__(self, n: int, seeds=None, frames_per_drop: int=3,
+                    auto_reset: bool=True, beans: BeanQueue=None,
+                    repeat_sequence: bool=False):
+        """
+        Instantiation
+
+        Args:
+            n (int): Number of games to play at once.
+            seeds (list[int], optional): One random seed per game. Defaults
+                                    to None, which leaves every game unseeded.
+            frames_per_drop (int, optional): Number of steps between automatic
+                                    drops of the controlled beans. Defaults to 3.
+            auto_reset (bool, optional): Whether to reset games as soon as
+                                    they are lost. Defaults to True.
+            beans (BeanQueue, optional): One bean sequence shared by every
+                                    game, so all games get the same beans.
+                                    Defaults to None, which gives each game
+                                    its own sequence from seeds.
+            repeat_sequence (bool, optional): If True, every reset starts the
+                                    game's bean sequence over. Defaults to False.
+        """
+        if seeds is None:
+            seeds = [None]*n
+        assert len(seeds) == n, "Expected one seed per game"
+
+        # Each game reads its own position of its own (or the shared) bean sequence
+        self.n      = n
+        self.beans  = beans
+        self.queues = [beans]*n if beans is not None else [BeanQueue(seed) for seed in seeds]
+        self.seeds  = [queue.seed for queue in self.queues]
+        self.bean_index      = np.zeros(n, dtype=int)
+        self.repeat_sequence = repeat_sequence
+
+        self.frames_per_drop = frames_per_drop
+        self.auto_reset      = auto_reset
+        self.boards          = np.arange(n)
+
+        # Playing fields and game status trackers
+        self.field     = np.zeros((n, 13, 6), dtype=int)
+        self.score     = np.zeros(n, dtype=int)
+        self.combo     = np.zeros(n, dtype=int)
+        self.gameover  = np.zeros(n, dtype=bool)
+        self.phase     = np.ones(n, dtype=int)     # 1 = waiting for a new pair, 2 = movement
+        self.timesteps = np.zeros(n, dtype=int)
+
+        # Controlled beans: pair state (see bean_kernels.pair_state), and the 
+        # colors of Bean 1 and Bean 2
+        self.pair   = np.zeros(n, dtype=int)
+        self.colors = np.zeros((n, 2), dtype=int)
+
+        self.next2 = self.new_beans(self.boards)
+        self.next1 = self.new_beans(self.boards)
+
+    def reset(self, boards=None):
+        """
+        Reset games, clearing their fields and scores.
+
+        Args:
+            boards (np.ndarray, optional): Indices of the games to reset.
+                                    Defaults to None, which resets all games.
+        """
+        if boards is None:
+            boards = self.boards
+
+        self.field[boards]     = 0
+        self.score[boards]     = 0
+        self.combo[boards]     = 0
+        self.gameover[boards]  = False
+        self.phase[boards]     = 1
+        self.timesteps[boards] = 0
+
+        if self.repeat_sequence:
+            self.bean_index[boards] = 0
+
+        self.next2[boards] = self.new_beans(boards)
+        self.next1[boards] = self.new_beans(boards)
+
+    def new_beans(self, boards):
+        """
+        Take the next bean color from each of the given games' sequences.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+
+        Returns:
+            [np.ndarray]: Integers corresponding to bean colors.
+        """
+        boards = np.asarray(boards)
+        index  = self.bean_index[boards]
+        self.bean_index[boards] += 1
+
+        if self.beans is not None:
+            return self.beans.take(index)
+
+        return np.array([self.queues[i][j] for i, j in zip(boards.tolist(), index.tolist())],
+                        dtype=int)
+
+    def step(self, actions):
+        """
+        Advance every game to its next decision point.
+
+        Args:
+            actions (np.ndarray): (N,) array of actions, using the same
+                                    codes as BeanMachine.movement.
+
+        Returns:
+            [tuple]: (field, rewards, dones). Games that finished on this
+                        step have already been reset if auto_reset is set.
+        """
+        actions = np.asarray(actions)
+        score_before = self.score.copy()
+
+        # Fresh games only spawn their first pair (the action is ignored,
+        # just as on the first BeanGymEnv step after a reset)
+        waiting = (self.phase == 1) & ~self.gameover
+        playing = (self.phase == 2) & ~self.gameover
+
+        # Phase 2 - Horizontal movement and rotation
+        for action, effect in ((1, lambda b: self.move(b, -1)),
+                                (2, lambda b: self.move(b, 1)),
+                                (3, lambda b: self.rotate(b, -1)),
+                                (4, lambda b: self.rotate(b, 1))):
+            effect(np.flatnonzero(playing & (actions == action)))
+
+        boards = np.flatnonzero(playing & (actions == 5))
+        self.score[boards[self.hard_drop(boards)]] += 1  # A point for hard dropping
+
+        # Phase 3 - Time increment
+        self.timesteps[playing] += 1
+        dropping = playing & (self.timesteps == self.frames_per_drop)
+        self.timesteps[dropping] = 0
+
+        # Phase 4 - Drop, and lock the beans that can't drop any further
+        boards = np.flatnonzero(dropping)
+        locked = boards[~self.hard_drop(boards)]
+
+        # Phases 5 to 8 - Settle the beans and resolve any chains
+        seeds = self.postdrop(locked)
+        self.resolve_chains(locked, seeds)
+
+        # Phase 0 - Check for loss
+        self.combo[locked] = 0
+        lost = self.field[locked, 0, :].max(axis=1) != 0
+        self.gameover[locked[lost]] = True
+
+        # Phase 1 - Set the new beans
+        waiting[locked[~lost]] = True
+        self.next_beans(np.flatnonzero(waiting))
+
+        rewards = self.score - score_before
+        dones   = self.gameover.copy()
+
+        if self.auto_reset and dones.any():
+            self.reset(np.flatnonzero(dones))
+
+        return self.field, rewards, dones
+
+    def next_beans(self, boards):
+        """
+        Add the next beans to the given games' fields and choose new next beans.
+        """
+        self.field[boards, 0, 3] = self.next2[boards]
+        self.field[boards, 1, 3] = self.next1[boards]
+
+        self.pair[boards]      = SPAWN_STATE
+        self.colors[boards, 0] = self.next1[boards]
+        self.colors[boards, 1] = self.next2[boards]
+
+        self.next2[boards] = self.new_beans(boards)
+        self.next1[boards] = self.new_beans(boards)
+
+        self.timesteps[boards] = 0
+        self.phase[boards]     = 2
+
+    def move_update(self, boards, state):
+        """
+        Update the fields when the controlled beans of the given games
+        move to new pair states.
+        """
+        old = PAIR_CELLS[self.pair[boards]]
+        new = PAIR_CELLS[state]
+
+        # Clear old pixels, then draw the new ones
+        self.field[boards, old[:, 0], old[:, 1]] = 0
+        self.field[boards, old[:, 2], old[:, 3]] = 0
+        self.field[boards, new[:, 2], new[:, 3]] = self.colors[boards, 1]
+        self.field[boards, new[:, 0], new[:, 1]] = self.colors[boards, 0]
+
+        self.pair[boards] = state
+
+    def shift_pair(self, boards, kind: int):
+        """
+        Move the controllable beans of the given games by one kind of
+        pair transition (see bean_kernels.PAIR_STEPS), where the spaces
+        it needs are free.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+            kind (int): Kind of transition, e.g. MOVE_DOWN.
+
+        Returns:
+            [np.ndarray]: Boolean mask of the games where the movement succeeded.
+        """
+        state, ya, xa, yb, xb = PAIR_STEPS[kind, self.pair[boards]].T
+
+        ok = ((state >= 0) & (self.field[boards, ya, xa] == 0) &
+                (self.field[boards, yb, xb] == 0))
+
+        self.move_update(boards[ok], state[ok])
+
+        return ok
+
+    def move(self, boards, direction: int):
+        """
+        Move the controllable beans of the given games horizontally.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+            direction (int): 1 or -1 (right or left, respectively)
+
+        Returns:
+            [np.ndarray]: Boolean mask of the games where the movement succeeded.
+        """
+        return self.shift_pair(boards, MOVE_RIGHT if direction > 0 else MOVE_LEFT)
+
+    def rotate(self, boards, direction: int):
+        """
+        Rotate the controllable beans of the given games. Bean 2 rotates
+        around Bean 1, and Bean 1 is pushed away from anything blocking
+        Bean 2, as in BeanMachine.rotate.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+            direction (int): 1 or -1 (clockwise or counter)
+
+        Returns:
+            [np.ndarray]: Boolean mask of the games where the rotation succeeded.
+        """
+        turn, kick = (TURN_CW, KICK_CW) if direction > 0 else (TURN_CCW, KICK_CCW)
+
+        ok = self.shift_pair(boards, turn)
+        blocked = ~ok
+        ok[blocked] = self.shift_pair(boards[blocked], kick)
+
+        return ok
+
+    def hard_drop(self, boards):
+        """
+        Move the controllable beans of the given games down one space,
+        where the spaces the beans would occupy are free.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+
+        Returns:
+            [np.ndarray]: Boolean mask of the games where the movement succeeded.
+        """
+        return self.shift_pair(boards, MOVE_DOWN)
+
+    def postdrop(self, boards):
+        """
+        Let the locked beans of the given games fall into place.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+
+        Returns:
+            [np.ndarray]: (len(boards), 13, 6) boolean mask of the cells
+                            the beans landed in.
+        """
+        seeds = np.zeros((len(boards), 13, 6), dtype=bool)
+        rows  = np.arange(13)
+
+        y1, x1, y2, x2 = PAIR_CELLS[self.pair[boards]].T
+        beans = ((y1, x1, self.colors[boards, 0]), (y2, x2, self.colors[boards, 1]))
+
+        # Lift both beans off the field, then land the lower one first
+        self.field[boards, y1, x1] = 0
+        self.field[boards, y2, x2] = 0
+
+        lower1 = y1 >= y2
+        for order, mask in (((0, 1), lower1), ((1, 0), ~lower1)):
+            which = np.flatnonzero(mask)
+            b     = boards[which]
+
+            for i in order:
+                y, x, c = (values[which] for values in beans[i])
+
+                below = (rows > y[:, None]) & (self.field[b, :, x] != 0)
+                y = np.where(below.any(axis=1), below.argmax(axis=1)-1, 12)
+
+                self.field[b, y, x] = c
+                seeds[which, y, x] = True
+
+        return seeds
+
+    def resolve_chains(self, boards, seeds):
+        """
+        Repeatedly remove complete groups and drop the beans above them
+        until no more groups form, updating scores and combos.
+
+        Args:
+            boards (np.ndarray): Indices of the games.
+            seeds (np.ndarray): (len(boards), 13, 6) boolean mask of beans
+                                    that have just moved.
+        """
+        while len(boards) > 0:
+            field = self.field[boards]
+            clear, groups = find_clears(field, seeds)
+
+            self.combo[boards] += groups
+            self.score[boards] += self.combo[boards]*clear.sum(axis=(1, 2))
+
+            chained = groups > 0
+            field[clear] = 0
+            field, moved = settle(field[chained])
+
+            boards = boards[chained]
+            seeds  = moved
+            self.field[boards] = field
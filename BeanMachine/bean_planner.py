@@ -0,0 +1,260 @@
+"""
+bean_planner.py
+
+Author: MCK
+
+Lookahead planner for the MeanBean game, for use as a non-learned
+baseline and as a teacher for imitation learning.
+
+The planner runs a beam search over the final placements of the
+controlled beans (see bean_machine.PLACEMENTS). Every node is
+simulated on a scratch BeanMachine with snapshot()/restore() and
+BeanMachine.place(), so a whole turn (drop, chains, next pair)
+costs one engine call instead of a loop through the phases.
+
+The scratch machine sees the controlled pair and the next pair,
+just like a player. Beans further ahead come from its own random
+sequence, not from the real game.
+
+Run this file to benchmark the planner's node throughput.
+"""
+
+import time
+
+import numpy as np
+
+from bean_machine import (BeanMachine, BeanQueue, TranspositionCache, PLACEMENTS,
+                            PAIR_SPACES, BELOW, LEFT, SNAPSHOT_SIZE)
+
+LOSS_VALUE = -1e6   # Value of a node where the game is lost
+
+def evaluate(field):
+    """
+    Heuristic value of a settled playing field: reward neighboring
+    beans of the same color (future groups), and penalize tall
+    stacks, especially in the column where new beans enter.
+
+    Args:
+        field (np.ndarray): Playing field.
+
+    Returns:
+        [float]: Value of the field.
+    """
+    occupied = field > 0
+
+    same = (np.count_nonzero(occupied[1:, :] & (field[1:, :] == field[:-1, :])) +
+            np.count_nonzero(occupied[:, 1:] & (field[:, 1:] == field[:, :-1])))
+
+    heights = occupied.sum(axis=0)
+    danger  = max(heights[3] - 8, 0)
+
+    return same - 0.25*heights.sum() - 4.0*danger*danger
+
+class Plan():
+    """
+    Result of a search.
+
+    Attributes:
+        placement (tuple): Best (column, orientation) for the controlled beans.
+        action (int): Index of the placement in PLACEMENTS.
+        actions (list[int]): BeanGymEnv actions that steer the beans there.
+        value (float): Value of the best line found.
+        nodes (int): Number of placements simulated.
+        seconds (float): Time spent searching.
+    """
+
+    def __init__(self, action, actions, value, nodes, seconds):
+        self.action    = action
+        self.placement = PLACEMENTS[action]
+        self.actions   = actions
+        self.value     = value
+        self.nodes     = nodes
+        self.seconds   = seconds
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / max(self.seconds, 1e-9)
+
+class BeamPlanner():
+
+    def __init__(self, depth: int=2, width: int=8, time_budget: float=None,
+                    evaluate=evaluate, seed: int=None, cache: TranspositionCache=None):
+        """
+        Instantiation
+
+        Args:
+            depth (int, optional): Number of pairs to look ahead. Depth 2 uses
+                                    the visible next pair. Defaults to 2.
+            width (int, optional): Number of nodes kept at each depth.
+                                    Defaults to 8.
+            time_budget (float, optional): Seconds allowed per search. The
+                                    search stops expanding nodes when it runs
+                                    out. Defaults to None (no limit).
+            evaluate (function, optional): Heuristic value of a playing field,
+                                    added to the score gained. Defaults to
+                                    bean_planner.evaluate.
+            seed (int, optional): Seed of the beans imagined beyond the visible
+                                    next pair. Defaults to None.
+            cache (TranspositionCache, optional): Cache of resolved chains for
+                                    the scratch machine. Positions searched
+                                    on one turn come up again on the next, so
+                                    the cache can be kept for a whole game.
+                                    Defaults to None.
+        """
+        self.depth       = depth
+        self.width       = width
+        self.time_budget = time_budget
+        self.evaluate    = evaluate
+
+        self.sim = BeanMachine(headless=True, beans=BeanQueue(seed), cache=cache)
+
+        # Preallocated snapshots: the root, and two layers of the beam
+        n = width*len(PLACEMENTS)
+        self.root   = np.empty(SNAPSHOT_SIZE, dtype=np.int64)
+        self.layers = [np.empty((n, SNAPSHOT_SIZE), dtype=np.int64) for _ in range(2)]
+
+    def plan(self, machine: BeanMachine):
+        """
+        Search for the best placement of the controlled beans.
+
+        Args:
+            machine (BeanMachine): Game waiting for movement (phase 2).
+                                    It is not modified.
+
+        Returns:
+            [Plan]: The best placement and how to reach it.
+        """
+        assert machine.phase == 2 and not machine.gameover, "The game must be waiting for movement"
+
+        start    = time.perf_counter()
+        deadline = None if self.time_budget is None else start + self.time_budget
+        sim      = self.sim
+        sim.frames_per_drop = machine.frames_per_drop
+
+        machine.snapshot(self.root)
+        base_score = machine.score
+
+        # Each beam entry is (value, first placement, row of the current layer,
+        # whether the game is lost)
+        beam   = [(0.0, None, -1, False)]
+        parent = self.root[None]
+        nodes  = 0
+        best   = None
+
+        for depth in range(self.depth):
+            layer = self.layers[depth % 2]
+            children = []
+
+            for value, first, row, lost in beam:
+                snap = self.root if row < 0 else parent[row]
+
+                # A lost game has nothing left to place, so it is carried 
+                # forward as it is (losing sooner stays worse than later)
+                if lost:
+                    layer[len(children)] = snap
+                    children.append((value, first, len(children), True))
+                    continue
+
+                for action, (column, orientation) in enumerate(PLACEMENTS):
+                    if deadline is not None and nodes > 0 and time.perf_counter() > deadline:
+                        break
+
+                    sim.restore(snap)
+
+                    # A pair of one color looks the same either way up
+                    if (sim.pair.color1 == sim.pair.color2) and orientation in (BELOW, LEFT):
+                        continue
+
+                    sim.place(column, orientation)
+                    nodes += 1
+
+                    if sim.gameover:
+                        child = LOSS_VALUE + depth
+                    else:
+                        child = (sim.score - base_score) + self.evaluate(sim.field)
+
+                    sim.snapshot(layer[len(children)])
+                    children.append((child, action if first is None else first, len(children),
+                                        sim.gameover))
+
+            if len(children) == 0:
+                break
+
+            children.sort(key=lambda node: node[0], reverse=True)
+            best   = children[0]
+            beam   = children[:self.width]
+            parent = layer
+
+            if best[0] <= LOSS_VALUE + self.depth or \
+                    (deadline is not None and time.perf_counter() > deadline):
+                break
+
+        action  = 0 if best is None else best[1]
+        actions = self.steer(machine, action)
+
+        return Plan(action, actions, LOSS_VALUE if best is None else best[0], nodes,
+                    time.perf_counter() - start)
+
+    def steer(self, machine: BeanMachine, action: int, max_steps: int=200):
+        """
+        Find the BeanGymEnv actions that steer the controlled beans to a
+        placement, by playing them out on the scratch machine (so the
+        automatic drops between inputs are accounted for).
+
+        Args:
+            machine (BeanMachine): Game waiting for movement (phase 2).
+            action (int): Index of the placement in PLACEMENTS.
+            max_steps (int, optional): Give up after this many actions.
+
+        Returns:
+            [list[int]]: Actions, ending with the one that locks the beans.
+        """
+        column, target = PLACEMENTS[action]
+
+        sim = self.sim
+        sim.restore(machine.snapshot(self.root))
+
+        actions = []
+        while len(actions) < max_steps:
+            turns = (target - sim.pair.orientation) % 4
+            x1    = PAIR_SPACES[sim.pair.state][1]
+
+            if turns == 3:
+                choice = 3
+            elif turns > 0:
+                choice = 4
+            elif x1 > column:
+                choice = 1
+            elif x1 < column:
+                choice = 2
+            else:
+                choice = 5
+
+            actions.append(choice)
+
+            # Same as BeanGymEnv.step. Done once the next pair has come in.
+            _, done, info = sim.run_until_decision(choice)
+            if done or info.locked:
+                break
+
+        return actions
+
+if __name__ == '__main__':
+    # Benchmark: play one game with the planner and report node throughput
+    planner = BeamPlanner(depth=2, width=8, seed=0)
+    game    = BeanMachine(seed=0, headless=True)
+    game.reset()
+
+    nodes   = 0
+    seconds = 0.0
+    turns   = 0
+    game.step()
+    while not game.gameover and turns < 200:
+        plan = planner.plan(game)
+        nodes   += plan.nodes
+        seconds += plan.seconds
+        turns   += 1
+        game.place(*plan.placement)
+
+    print(f"Turns: {turns} | Score: {game.score} | Nodes: {nodes} | "
+            f"Nodes/sec: {nodes/seconds:.0f} | ms/turn: {1000*seconds/turns:.1f}")
@@ -0,0 +1,299 @@
+"""
+bean_recorder.py
+
+Author: MCK
+
+Compact episode archives for the MeanBean game.
+
+The game is deterministic given its bean sequence, and the bean
+sequence is determined by the seed, so an episode is stored as
+just its seed, the engine settings and the actions taken (one
+byte each). Any state of the episode is rebuilt by replaying the
+actions on a headless BeanMachine.
+
+File format (all integers little-endian):
+
+    episodes.bin      Append-only list of episodes. Each one is an
+                      EPISODE_HEADER followed by its actions (uint8).
+    episodes.bin.idx  Append-only uint64 byte offset of each episode
+                      in episodes.bin, for random access.
+
+If the index is lost, EpisodeReader.rebuild_index scans the
+episodes to write it again.
+"""
+
+import os, struct
+
+import numpy as np
+
+from bean_machine import BeanMachine, BeanQueue, PLACEMENTS
+
+MAGIC   = b'BEAN'
+VERSION = 3
+
+# magic, version, flags, frame skip, frames per drop, seed (128 bits), bean
+# queue chunk size, bean index at the start, number of actions, final score
+EPISODE_HEADER = struct.Struct('<4sBBBH16sIQIq')
+
+# Flags
+PLACEMENT   = 1     # Actions are placements (BeanMachine.place), not moves
+WHOLE_BOARD = 2     # Game used whole-board group detection
+GAMEOVER    = 4     # Episode ended in Game Over (not cut short)
+
+class Episode():
+    """
+    One recorded episode.
+
+    Attributes:
+        seed (int): Seed of the bean sequence.
+        chunk_size (int): Chunk size of its BeanQueue (the sequence depends 
+                            on it).
+        start (int): Position of the game's first bean in the bean sequence.
+        frames_per_drop (int): Engine setting.
+        frame_skip (int): Decisions each action was repeated for (see 
+                            BeanMachine.run_until_decision).
+        placement (bool): Whether the actions are placements (indices into
+                            PLACEMENTS) rather than BeanGymEnv moves.
+        whole_board (bool): Engine setting.
+        gameover (bool): Whether the episode ended in Game Over.
+        score (int): Final score.
+        actions (np.ndarray): uint8 actions.
+    """
+
+    def __init__(self, seed, start, frames_per_drop, flags, score, actions, frame_skip=1,
+                    chunk_size=1024):
+        self.seed            = seed
+        self.chunk_size      = chunk_size
+        self.start           = start
+        self.frames_per_drop = frames_per_drop
+        self.frame_skip      = frame_skip
+        self.placement       = bool(flags & PLACEMENT)
+        self.whole_board     = bool(flags & WHOLE_BOARD)
+        self.gameover        = bool(flags & GAMEOVER)
+        self.score           = score
+        self.actions         = actions
+
+    def __len__(self):
+        return len(self.actions)
+
+    def replay(self, steps: int=None, machine: BeanMachine=None):
+        """
+        Rebuild the game after some of the actions by replaying them
+        at headless speed.
+
+        Args:
+            steps (int, optional): Number of actions to replay. Defaults to
+                                    None, which replays them all.
+            machine (BeanMachine, optional): Game to replay on, which must
+                                    be headless. Defaults to None, which
+                                    creates one.
+
+        Returns:
+            [BeanMachine]: The game, as it was after that many actions.
+        """
+        beans = BeanQueue(self.seed, self.chunk_size)
+
+        if machine is None:
+            machine = BeanMachine(headless=True, beans=beans,
+                                    frames_per_drop=self.frames_per_drop,
+                                    whole_board=self.whole_board)
+        else:
+            machine.beans = beans
+            machine.seed  = beans.seed
+            machine.frames_per_drop = self.frames_per_drop
+            machine.whole_board     = self.whole_board
+            machine.repeat_sequence = False
+
+        machine.bean_index = self.start
+        machine.reset()
+
+        actions = self.actions[:steps].tolist()
+
+        if self.placement:
+            # Same as BeanGymPlacementEnv
+            machine.step()
+            for action in actions:
+                machine.place(*PLACEMENTS[action])
+
+        else:
+            # Same as BeanGymEnv.step
+            for action in actions:
+                _ = machine.run_until_decision(action, self.frame_skip)
+
+        return machine
+
+class EpisodeRecorder():
+    """
+    Appends episodes to an archive as they are played.
+
+    Usage:
+        machine.reset()
+        recorder.begin(machine)
+        ...
+        recorder.record(action)   # After each step
+        ...
+        recorder.end(machine)     # Writes the episode
+    """
+
+    def __init__(self, path: str):
+        """
+        Instantiation
+
+        Args:
+            path (str): Archive file. Created if it does not exist, and
+                        appended to if it does.
+        """
+        self.path    = path
+        self.data    = open(path, 'ab')
+        self.index   = open(path + '.idx', 'ab')
+        self.actions = bytearray()
+        self.header  = None     # (flags, frame skip, frames per drop, seed, chunk size,
+                                #  start) of the episode
+
+    def begin(self, machine: BeanMachine, placement: bool=False, frame_skip: int=1):
+        """
+        Start recording an episode. Call right after machine.reset().
+
+        Args:
+            machine (BeanMachine): Game being played.
+            placement (bool, optional): If True, the actions are placements
+                                    (as in BeanGymPlacementEnv). Defaults
+                                    to False.
+            frame_skip (int, optional): Decisions each action is repeated 
+                                    for (as in BeanGymEnv). Defaults to 1.
+        """
+        assert machine.phase <= 2 and machine.score == 0, "Recording must start at a reset"
+
+        flags = (PLACEMENT if placement else 0) | (WHOLE_BOARD if machine.whole_board else 0)
+
+        self.header  = (flags, frame_skip, machine.frames_per_drop, machine.seed,
+                        machine.beans.chunk_size, machine.start_index)
+        self.actions = bytearray()
+
+    def record(self, action: int):
+        """
+        Add an action to the episode being recorded.
+        """
+        self.actions.append(action)
+
+    def end(self, machine: BeanMachine):
+        """
+        Write the episode being recorded to the archive. An episode with 
+        no actions (e.g. a reset right before closing) is dropped.
+
+        Args:
+            machine (BeanMachine): Game being played, for its final score
+                                    and whether it ended in Game Over.
+        """
+        if self.header is None or len(self.actions) == 0:
+            self.header = None
+            return
+
+        flags, frame_skip, frames_per_drop, seed, chunk_size, start = self.header
+        if machine.gameover:
+            flags |= GAMEOVER
+
+        header = EPISODE_HEADER.pack(MAGIC, VERSION, flags, frame_skip, frames_per_drop,
+                                        int(seed).to_bytes(16, 'little'), chunk_size, start,
+                                        len(self.actions), machine.score)
+
+        self.index.write(struct.pack('<Q', self.data.tell()))
+        self.data.write(header)
+        self.data.write(self.actions)
+
+        self.header = None
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def close(self):
+        """
+        Close the archive. An episode still being recorded is dropped.
+        """
+        self.data.close()
+        self.index.close()
+
+class EpisodeReader():
+    """
+    Random access to the episodes in an archive.
+
+    reader[n] reads episode n with a single seek, using the index.
+    """
+
+    def __init__(self, path: str):
+        """
+        Instantiation
+
+        Args:
+            path (str): Archive file written by EpisodeRecorder.
+        """
+        self.path = path
+        if not os.path.exists(path + '.idx'):
+            self.rebuild_index(path)
+
+        self.offsets = np.fromfile(path + '.idx', dtype='<u8')
+        self.data    = open(path, 'rb')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, n: int):
+        """
+        Read episode n.
+
+        Returns:
+            [Episode]: The episode.
+        """
+        self.data.seek(int(self.offsets[n]))
+        return self.read_episode(self.data)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    @staticmethod
+    def read_episode(f):
+        """
+        Read the episode at the current position of a file.
+
+        Returns:
+            [Episode]: The episode, or None at the end of the file.
+
+        Raises:
+            ValueError: If the file isn't an episode archive, or was 
+                        written by another version of the recorder.
+        """
+        header = f.read(EPISODE_HEADER.size)
+        if len(header) < EPISODE_HEADER.size:
+            return None
+
+        magic, version, flags, frame_skip, frames_per_drop, seed, chunk_size, start, n, score = \
+            EPISODE_HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not an episode archive")
+        if version != VERSION:
+            raise ValueError(f"Episode archive version {version}, expected {VERSION}")
+
+        actions = np.frombuffer(f.read(n), dtype=np.uint8)
+
+        return Episode(int.from_bytes(seed, 'little'), start, frames_per_drop, flags,
+                        score, actions, frame_skip, chunk_size)
+
+    @staticmethod
+    def rebuild_index(path: str):
+        """
+        Write the index of an archive by scanning its episodes.
+        """
+        offsets = []
+        with open(path, 'rb') as f:
+            while True:
+                offset = f.tell()
+                if EpisodeReader.read_episode(f) is None:
+                    break
+                offsets.append(offset)
+
+        np.array(offsets, dtype='<u8').tofile(path + '.idx')
+
+    def close(self):
+        self.data.close()
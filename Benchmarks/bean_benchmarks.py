@@ -0,0 +1,454 @@
+"""
+bean_benchmarks.py
+
+Author: MCK
+
+Speed benchmarks for the MeanBean engines, environments and
+renderers, so slowdowns are caught when they are committed
+instead of when training gets slower.
+
+Every workload is deterministic: its games, boards and actions
+come from fixed seeds, so two runs do the same work, and results
+from different commits can be compared. Each workload times every
+operation separately and reports operations per second along with
+latency percentiles.
+
+Usage:
+    python bean_benchmarks.py                       Run everything, save bench-<commit>.json
+    python bean_benchmarks.py -k env --scale 0.1    Quick run of the workloads matching 'env'
+    python bean_benchmarks.py --compare old.json new.json
+"""
+
+import argparse, itertools, json, os, platform, subprocess, sys, time
+
+import numpy as np
+
+from bean_machine import BeanMachine, PLACEMENTS, resolve_chains
+from bean_bitboard import BitBeanMachine
+from bean_machine_batch import BeanMachineBatch
+from bean_planner import BeamPlanner
+
+# Registered workloads, by name: (setup function, number of operations, unit,
+# units per operation)
+WORKLOADS = {}
+
+def workload(name: str, ops: int, unit: str='op', per_op: int=1):
+    """
+    Register a workload. The decorated setup function builds everything
+    the workload needs and returns (op, close): a function that performs
+    one operation, and a function that cleans up afterwards (or None).
+
+    Args:
+        name (str): Workload name.
+        ops (int): Number of operations to time.
+        unit (str, optional): What one unit of work is. Defaults to 'op'.
+        per_op (int, optional): Units of work in one operation, e.g. the
+                                number of games in a batched step.
+                                Defaults to 1.
+    """
+    def register(setup):
+        WORKLOADS[name] = (setup, ops, unit, per_op)
+        return setup
+    return register
+
+def crowded_boards(count: int, rows: int=10, seed: int=0):
+    """
+    Random boards with their bottom rows full, which are mostly made up
+    of complete groups and resolve into long chains.
+
+    Returns:
+        [np.ndarray]: (count, 13, 6) playing fields.
+    """
+    rng    = np.random.default_rng(seed)
+    boards = np.zeros((count, 13, 6), dtype=int)
+    boards[:, 13-rows:] = rng.integers(2, 7, (count, rows, 6))
+    return boards
+
+def recorded_fields(count: int, seed: int=0):
+    """
+    Fields from a game played with random moves, for the renderers.
+
+    Returns:
+        [np.ndarray]: (count, 13, 6) playing fields.
+    """
+    rng     = np.random.default_rng(seed)
+    machine = BeanMachine(seed=seed, headless=True)
+    machine.reset()
+
+    fields = np.empty((count, 13, 6), dtype=int)
+    for i in range(count):
+        _ = machine.run_until_decision(int(rng.integers(6)))
+        fields[i] = machine.field
+        if machine.gameover:
+            machine.reset()
+
+    return fields
+
+def machine_steps(machine: BeanMachine, seed: int=0):
+    """
+    Operation that advances a game by one phase (BeanMachine.step), with
+    a random action at every decision.
+    """
+    actions = itertools.cycle(np.random.default_rng(seed).integers(0, 6, 4096).tolist())
+    machine.reset()
+
+    def op():
+        if machine.phase == 2:
+            machine.action = next(actions)
+        machine.step()
+        if machine.gameover:
+            machine.reset()
+
+    return op
+
+@workload('machine_step', ops=200000, unit='phase')
+def bench_machine_step():
+    return machine_steps(BeanMachine(seed=0, headless=True)), None
+
+@workload('bitboard_step', ops=200000, unit='phase')
+def bench_bitboard_step():
+    return machine_steps(BitBeanMachine(seed=0, headless=True)), None
+
+def env_steps(env, actions):
+    """
+    Operation that takes one environment step, cycling through a list
+    of actions and resetting when the game ends.
+    """
+    actions = itertools.cycle(actions)
+    env.reset()
+
+    def op():
+        _, _, done, _ = env.step(next(actions))
+        if done:
+            env.reset()
+
+    return op
+
+@workload('env_step_random', ops=50000, unit='step')
+def bench_env_step_random():
+    from bean_gym.envs import BeanGymEnv
+    env = BeanGymEnv(headless=True)
+    env.seed(0)
+    return env_steps(env, np.random.default_rng(0).integers(0, 6, 4096).tolist()), env.close
+
+@workload('env_step_scripted', ops=50000, unit='step')
+def bench_env_step_scripted():
+    from bean_gym.envs import BeanGymEnv
+    env = BeanGymEnv(headless=True)
+    env.seed(0)
+
+    # Sweep pairs across the field in turn: move, rotate, then hard drop
+    script = []
+    for column in range(6):
+        moves   = [1]*(3 - column) if column < 3 else [2]*(column - 3)
+        script += moves + [4]*(column % 2) + [5]*12
+
+    return env_steps(env, script), env.close
+
+@workload('placement_env_step', ops=5000, unit='placement')
+def bench_placement_env_step():
+    from bean_gym.envs import BeanGymPlacementEnv
+    env = BeanGymPlacementEnv()
+    env.seed(0)
+    return env_steps(env, np.random.default_rng(0).integers(0, len(PLACEMENTS), 4096).tolist()), env.close
+
+def chain_setup(machine: BeanMachine, boards: np.ndarray):
+    """
+    Prepare a game to check one of the boards for complete groups, as if
+    every bean on it had just dropped.
+
+    Returns:
+        [function]: Takes the operation number and sets up the game.
+    """
+    cells = [(y, x) for y in range(13) for x in range(6)]
+
+    def load(i):
+        machine.field      = boards[i % len(boards)].copy()
+        machine.dropped_yx = list(cells)
+        machine.combo      = 0
+        machine.phase      = 6
+
+    return load
+
+@workload('completion_check', ops=5000, unit='board')
+def bench_completion_check():
+    machine = BeanMachine(seed=0, headless=True)
+    load    = chain_setup(machine, crowded_boards(64))
+    count   = itertools.count()
+
+    def op():
+        load(next(count))
+        machine.completion_check()
+
+    return op, None
+
+def chain_resolve(machine: BeanMachine):
+    """
+    Operation that plays out every chain on a crowded board.
+    """
+    load  = chain_setup(machine, crowded_boards(64))
+    count = itertools.count()
+
+    def op():
+        load(next(count))
+        while machine.phase != 0:
+            machine.step()
+
+    return op
+
+@workload('chain_resolve', ops=2000, unit='board')
+def bench_chain_resolve():
+    return chain_resolve(BeanMachine(seed=0, headless=True)), None
+
+@workload('chain_resolve_whole_board', ops=2000, unit='board')
+def bench_chain_resolve_whole_board():
+    return chain_resolve(BeanMachine(seed=0, headless=True, whole_board=True)), None
+
+@workload('chain_resolve_bitboard', ops=2000, unit='board')
+def bench_chain_resolve_bitboard():
+    return chain_resolve(BitBeanMachine(seed=0, headless=True)), None
+
+@workload('chain_resolve_bitboard_whole', ops=2000, unit='board')
+def bench_chain_resolve_bitboard_whole_board():
+    return chain_resolve(BitBeanMachine(seed=0, headless=True, whole_board=True)), None
+
+@workload('resolve_chains', ops=5000, unit='board')
+def bench_resolve_chains():
+    boards = crowded_boards(64)
+    cells  = [(y, x) for y in range(13) for x in range(6)]
+    count  = itertools.count()
+
+    def op():
+        resolve_chains(boards[next(count) % len(boards)].copy(), cells)
+
+    return op, None
+
+@workload('render_rgb_array', ops=20000, unit='frame')
+def bench_render_rgb_array():
+    from bean_gym.envs.bean_render import ArrayRenderer
+    renderer = ArrayRenderer(preview=True)
+    fields   = itertools.cycle(list(recorded_fields(256)))
+    return (lambda: renderer.render(next(fields), (2, 3))), None
+
+@workload('render_human', ops=2000, unit='frame')
+def bench_render_human():
+    # Needs the gym Viewer (pyglet) and a display
+    from gym.envs.classic_control import rendering
+    from bean_gym.envs.bean_render import FieldBatch
+
+    viewer = rendering.Viewer(300, 650)
+    batch  = FieldBatch()
+    viewer.add_geom(batch)
+    fields = itertools.cycle(list(recorded_fields(256)))
+
+    def op():
+        batch.update(next(fields))
+        viewer.render()
+
+    return op, viewer.close
+
+@workload('batch_step', ops=2000, unit='game step', per_op=256)
+def bench_batch_step():
+    batch   = BeanMachineBatch(256, seeds=list(range(256)))
+    actions = itertools.cycle(list(np.random.default_rng(0).integers(0, 6, (64, 256))))
+    return (lambda: batch.step(next(actions))), None
+
+@workload('vec_env_step', ops=5000, unit='game step', per_op=4)
+def bench_vec_env_step():
+    from bean_gym.envs import BeanGymVecEnv
+    env     = BeanGymVecEnv(4, seeds=[0, 1, 2, 3])
+    actions = itertools.cycle(list(np.random.default_rng(0).integers(0, 6, (64, 4))))
+    env.reset()
+    return (lambda: env.step(next(actions))), env.close
+
+@workload('planner_plan', ops=200, unit='decision')
+def bench_planner_plan():
+    planner = BeamPlanner(depth=2, width=8, seed=0)
+    game    = BeanMachine(seed=0, headless=True)
+    game.reset()
+    game.step()
+
+    def op():
+        if game.gameover:
+            game.reset()
+            game.step()
+        game.place(*planner.plan(game).placement)
+
+    return op, None
+
+def measure(op, ops: int, warmup: int):
+    """
+    Time an operation.
+
+    Args:
+        op (function): Operation to time.
+        ops (int): Number of timed calls.
+        warmup (int): Number of untimed calls first (e.g. for compilation).
+
+    Returns:
+        [tuple]: (total seconds, np.ndarray of nanoseconds per call)
+    """
+    for _ in range(warmup):
+        op()
+
+    clock = time.perf_counter_ns
+    times = []
+    start = clock()
+    for _ in range(ops):
+        t = clock()
+        op()
+        times.append(clock() - t)
+    total = clock() - start
+
+    return total / 1e9, np.array(times)
+
+def run(name: str, scale: float=1.0):
+    """
+    Run one workload.
+
+    Args:
+        name (str): Workload name.
+        scale (float, optional): Multiplier on the number of operations.
+                                    Defaults to 1.
+
+    Returns:
+        [dict]: Results, or the reason the workload was skipped.
+    """
+    setup, ops, unit, per_op = WORKLOADS[name]
+    ops = max(1, int(ops*scale))
+
+    try:
+        op, close = setup()
+    except Exception as error:
+        return {'skipped': f"{type(error).__name__}: {error}"}
+
+    try:
+        seconds, times = measure(op, ops, warmup=max(1, ops // 20))
+    finally:
+        if close is not None:
+            close()
+
+    p50, p90, p99 = np.percentile(times, [50, 90, 99]) / 1e3
+
+    return {'ops': ops,
+            'unit': unit,
+            'per_op': per_op,
+            'seconds': seconds,
+            'ops_per_sec': ops / seconds,
+            'units_per_sec': ops*per_op / seconds,
+            'p50_us': p50,
+            'p90_us': p90,
+            'p99_us': p99,
+            'max_us': times.max() / 1e3}
+
+def environment():
+    """
+    Describe the code and machine the benchmarks ran on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+
+    return {'commit': commit or None,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'numba': numba_version,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+def compare(old: dict, new: dict, threshold: float=0.1):
+    """
+    Print the change in throughput of each workload between two result
+    files.
+
+    Args:
+        old, new (dict): Benchmark results.
+        threshold (float, optional): Slowdown to flag as a regression.
+                                    Defaults to 0.1 (10%).
+
+    Returns:
+        [list[str]]: Names of the workloads that regressed.
+    """
+    print(f"{'workload':28s} {old['environment']['commit'] or 'old':>12s} "
+            f"{new['environment']['commit'] or 'new':>12s}   change    p99 change")
+
+    regressions = []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        a = old['results'][name]
+        b = new['results'][name]
+        if 'skipped' in a or 'skipped' in b:
+            print(f"{name:28s} {'skipped':>12s}")
+            continue
+
+        change = b['units_per_sec'] / a['units_per_sec'] - 1
+        flag   = '  REGRESSION' if change < -threshold else ''
+        if flag:
+            regressions.append(name)
+
+        print(f"{name:28s} {a['units_per_sec']:12.0f} {b['units_per_sec']:12.0f} "
+                f"{100*change:+7.1f}%  {100*(b['p99_us']/a['p99_us'] - 1):+7.1f}%{flag}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="MeanBean speed benchmarks.")
+    parser.add_argument('-k', dest='match', default='',
+                        help="Only run workloads whose name contains this")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Multiplier on the number of operations")
+    parser.add_argument('--out', default=None,
+                        help="Result file. Defaults to bench-<commit>.json")
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS',
+                        help="Compare a result file with another, or with a new run")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Slowdown flagged as a regression by --compare")
+    parser.add_argument('--list', action='store_true', help="List the workloads")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, ops, unit, per_op) in WORKLOADS.items():
+            print(f"{name:28s} {ops:8d} x {per_op} {unit}")
+        return
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            regressions = compare(json.load(f), json.load(g), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    env     = environment()
+    results = {}
+    for name in WORKLOADS:
+        if args.match not in name:
+            continue
+
+        results[name] = result = run(name, args.scale)
+        if 'skipped' in result:
+            print(f"{name:28s} skipped ({result['skipped']})")
+        else:
+            print(f"{name:28s} {result['units_per_sec']:12.0f} {result['unit']}/s   "
+                    f"p50 {result['p50_us']:9.1f} us   p99 {result['p99_us']:9.1f} us")
+
+    report = {'environment': env, 'scale': args.scale, 'results': results}
+
+    out = args.out or f"bench-{env['commit'] or 'local'}.json"
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {out}")
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
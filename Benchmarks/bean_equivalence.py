@@ -0,0 +1,325 @@
+"""
+bean_equivalence.py
+
+Author: MCK
+
+Equivalence checks for the MeanBean engines: every fast path
+(bitboards, batches, whole-board labeling, one-call chain
+resolution) must leave the game in exactly the state the plain
+phase-by-phase BeanMachine would.
+
+Every check is deterministic: its boards, seeds and actions come
+from fixed seeds, so a failure can be replayed. A failing check
+prints its first few mismatches, and the run exits with status 1.
+
+Usage:
+    python bean_equivalence.py                  Run every check
+    python bean_equivalence.py -k bitboard      Only the checks matching 'bitboard'
+"""
+
+import argparse, sys
+
+import numpy as np
+
+from bean_machine import (BeanMachine, TranspositionCache, PLACEMENTS, zobrist_hash,
+                            resolve_chains)
+from bean_bitboard import BitBeanMachine
+from bean_machine_batch import BeanMachineBatch, settle
+
+# Registered checks, by name: (check function, number of cases)
+CHECKS = {}
+
+def check(name: str, cases: int):
+    """
+    Register a check. The decorated function takes the number of cases
+    to try and returns a list of mismatches (empty if there are none).
+
+    Args:
+        name (str): Check name.
+        cases (int): Number of cases to try.
+    """
+    def register(function):
+        CHECKS[name] = (function, cases)
+        return function
+    return register
+
+class CountingClock():
+    """
+    Clock that only counts its ticks, so the frames a chain takes can
+    be compared.
+    """
+
+    def __init__(self):
+        self.ticks = 0
+
+    def tick(self):
+        self.ticks += 1
+
+def black_boards(count: int, seed: int=0):
+    """
+    Random settled boards with black beans scattered through them, and
+    for each one a few of its beans to check, in a random order.
+
+    Returns:
+        [list[tuple]]: (board, seed cells) for each board.
+    """
+    rng    = np.random.default_rng(seed)
+    boards = []
+    for _ in range(count):
+        board   = np.zeros((13, 6), dtype=int)
+        heights = rng.integers(0, 12, 6)
+        for x, height in enumerate(heights.tolist()):
+            colors = rng.integers(2, 7, height)
+            colors[rng.random(height) < 0.2] = 1
+            board[13-height:, x] = colors
+
+        ys, xs = np.nonzero(board)
+        if len(ys) == 0:
+            continue
+        picks = rng.permutation(len(ys))[:rng.integers(1, 5)]
+        boards.append((board, list(zip(ys[picks].tolist(), xs[picks].tolist()))))
+
+    return boards
+
+def play_chain(machine: BeanMachine, board: np.ndarray, seeds):
+    """
+    Play out the chain started by some beans of a board through the
+    machine's phases (6-8).
+
+    Returns:
+        [tuple]: (field after the chain, points scored, frames taken)
+    """
+    machine.field      = board.copy()
+    machine.dropped_yx = list(seeds)
+    machine.score      = 0
+    machine.combo      = 0
+    machine.phase      = 6
+
+    start = machine.clock.ticks
+    while machine.phase != 0:
+        machine.step()
+
+    return machine.field.copy(), machine.score, machine.clock.ticks - start
+
+def compare_chains(machines, boards):
+    """
+    Play the same chains on several machines and list the boards on
+    which any of them disagrees with the first.
+    """
+    mismatches = []
+    for i, (board, seeds) in enumerate(boards):
+        results = [play_chain(machine, board, seeds) for machine in machines]
+        field, score, frames = results[0]
+
+        for machine, (other, points, ticks) in zip(machines[1:], results[1:]):
+            if not np.array_equal(field, other) or score != points or frames != ticks:
+                mismatches.append(f"board {i}, seeds {seeds}: {type(machine).__name__} "
+                                    f"(whole_board={machine.whole_board}) scored {points} "
+                                    f"in {ticks} frames, expected {score} in {frames}")
+
+    return mismatches
+
+@check('bitboard_black_beans', cases=3000)
+def check_bitboard_black_beans(cases: int):
+    # The groups the seeds belong to claim the black beans they touch in
+    # seed order, in every engine and mode. (Whole-board mode also clears
+    # complete groups without a seed, so each mode is compared across the
+    # two engines.)
+    seeded = [BeanMachine(seed=0, headless=True, clock=CountingClock()),
+                BitBeanMachine(seed=0, headless=True, clock=CountingClock())]
+    whole  = [BeanMachine(seed=0, headless=True, clock=CountingClock(), whole_board=True),
+                BitBeanMachine(seed=0, headless=True, clock=CountingClock(), whole_board=True)]
+    boards = black_boards(cases)
+
+    return compare_chains(seeded, boards) + compare_chains(whole, boards)
+
+@check('batch_games', cases=5000)
+def check_batch_games(cases: int):
+    # One batch step must match one run_until_decision of a lone
+    # BeanMachine with the same seed, for every game in the batch
+    seeds    = [0, 1, 2, 3, 4, 5, 6, 7]
+    batch    = BeanMachineBatch(len(seeds), seeds=seeds)
+    machines = [BeanMachine(seed=seed, headless=True) for seed in seeds]
+    rng      = np.random.default_rng(0)
+
+    mismatches = []
+    for step in range(cases):
+        actions = rng.integers(0, 6, len(seeds))
+        field, rewards, dones = batch.step(actions)
+
+        for i, machine in enumerate(machines):
+            reward, done, _ = machine.run_until_decision(int(actions[i]))
+            if done:
+                machine.reset()
+
+            if reward != rewards[i] or done != dones[i] or \
+                    not np.array_equal(machine.field, field[i]):
+                mismatches.append(f"step {step}, game {i}: reward {rewards[i]}, done "
+                                    f"{dones[i]}, expected {reward}, {done}")
+
+    return mismatches
+
+@check('compact_columns', cases=3000)
+def check_compact_columns(cases: int):
+    # The one-pass column compaction of completion_drop must match the
+    # batch engine's gravity (an independent implementation), take one
+    # frame per row the highest bean falls, report exactly the beans that
+    # fell, and keep the Zobrist hash up to date
+    machine = BeanMachine(seed=0, headless=True, clock=CountingClock(),
+                            cache=TranspositionCache())
+    rng     = np.random.default_rng(0)
+
+    mismatches = []
+    for i in range(cases):
+        board = rng.integers(1, 7, (13, 6))
+        board[rng.random((13, 6)) < rng.random()] = 0
+
+        settled, moved = settle(board[None])
+        falls = [int(np.count_nonzero(board[np.argmax(board[:, x] != 0):, x] == 0))
+                    if board[:, x].any() else 0 for x in range(6)]
+
+        machine.field = board.copy()
+        machine.rehash()
+        machine.clear_x[:6] = np.arange(6)
+        machine.cleared     = 6
+        machine.phase       = 8
+
+        start = machine.clock.ticks
+        machine.step()
+        frames = list(machine.drop_frames())
+
+        if not np.array_equal(machine.field, settled[0]) or \
+                sorted(machine.dropped_yx) != sorted(zip(*np.nonzero(moved[0]))) or \
+                machine.clock.ticks - start != max(falls) or len(frames) != max(falls) or \
+                (frames and not np.array_equal(frames[-1], settled[0])) or \
+                machine.hash != zobrist_hash(settled[0]):
+            mismatches.append(f"board {i}: {board.tolist()}")
+
+    return mismatches
+
+def phase_machine(**kwargs):
+    """
+    BeanMachine that plays every chain out phase by phase: a listener 
+    turns off the one-call chain resolution. The listener records the 
+    beans cleared in each link of the chains, in machine.links_cleared.
+    """
+    machine = BeanMachine(headless=True, clock=CountingClock(), **kwargs)
+    machine.links_cleared = []
+
+    def listener(machine, event, data):
+        if event == 'chain_step':
+            machine.links_cleared.append(data['cleared'])
+
+    machine.subscribe(listener)
+
+    return machine
+
+def compare_games(machines, cases: int, placement: bool=False):
+    """
+    Play the same random actions (or placements) on several seeded 
+    machines and list the steps after which any of them disagrees with 
+    the first on the field, score, Game Over flag or frames played.
+    """
+    rng = np.random.default_rng(0)
+    for machine in machines:
+        machine.reset()
+        machine.step()
+
+    mismatches = []
+    for step in range(cases):
+        if placement:
+            column, orientation = PLACEMENTS[int(rng.integers(len(PLACEMENTS)))]
+            for machine in machines:
+                machine.place(column, orientation)
+        else:
+            action = int(rng.integers(6))
+            for machine in machines:
+                _ = machine.run_until_decision(action)
+
+        first = machines[0]
+        for machine in machines[1:]:
+            if not np.array_equal(first.field, machine.field) or first.score != machine.score or \
+                    first.gameover != machine.gameover or \
+                    first.clock.ticks != machine.clock.ticks:
+                mismatches.append(f"step {step}: machine {machines.index(machine)} scored "
+                                    f"{machine.score} in {machine.clock.ticks} frames, "
+                                    f"expected {first.score} in {first.clock.ticks}")
+
+        if first.gameover:
+            for machine in machines:
+                machine.reset()
+                machine.step()
+
+    return mismatches
+
+@check('chain_fast_path', cases=20000)
+def check_chain_fast_path(cases: int):
+    # One-call chain resolution and cached chains must play out exactly
+    # as the phases do, in seeded and whole-board mode
+    machines = [phase_machine(seed=0),
+                BeanMachine(seed=0, headless=True, clock=CountingClock()),
+                BeanMachine(seed=0, headless=True, clock=CountingClock(),
+                            cache=TranspositionCache()),
+                BeanMachine(seed=0, headless=True, clock=CountingClock(), whole_board=True)]
+
+    return compare_games(machines, cases)
+
+@check('place', cases=3000)
+def check_place(cases: int):
+    # Whole turns played by place() with one-call chain resolution (and
+    # cached chains) must match the same turns played phase by phase
+    machines = [phase_machine(seed=1),
+                BeanMachine(seed=1, headless=True, clock=CountingClock()),
+                BeanMachine(seed=1, headless=True, clock=CountingClock(),
+                            cache=TranspositionCache())]
+
+    return compare_games(machines, cases, placement=True)
+
+@check('resolve_chains', cases=3000)
+def check_resolve_chains(cases: int):
+    # The standalone chain resolution must match the phases, including
+    # which group claims black beans
+    machine    = phase_machine(seed=0)
+    mismatches = []
+    for i, (board, seeds) in enumerate(black_boards(cases, seed=1)):
+        machine.links_cleared = []
+        field, score, _ = play_chain(machine, board, seeds)
+
+        other = board.copy()
+        chain, cleared, points = resolve_chains(other, seeds)
+
+        if not np.array_equal(field, other) or score != points or \
+                cleared != machine.links_cleared or chain != len(cleared):
+            mismatches.append(f"board {i}, seeds {seeds}: cleared {cleared} for {points}, "
+                                f"expected {machine.links_cleared} for {score}")
+
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="MeanBean engine equivalence checks.")
+    parser.add_argument('-k', dest='match', default='',
+                        help="Only run checks whose name contains this")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="Multiplier on the number of cases")
+    args = parser.parse_args()
+
+    failed = []
+    for name, (function, cases) in CHECKS.items():
+        if args.match not in name:
+            continue
+
+        cases      = max(1, int(cases*args.scale))
+        mismatches = function(cases)
+
+        if mismatches:
+            failed.append(name)
+            print(f"{name:28s} FAILED ({len(mismatches)} mismatches)")
+            for mismatch in mismatches[:5]:
+                print(f"    {mismatch}")
+        else:
+            print(f"{name:28s} ok ({cases} cases)")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,9 @@ from gym.envs.registration import register
 register(
     id='BeanGym-v0',
     entry_point='bean_gym.envs:BeanGymEnv'
-)
\ No newline at end of file
+)
+
+register(
+    id='BeanGymPlacement-v0',
+    entry_point='bean_gym.envs:BeanGymPlacementEnv'
+)
@@ -1 +1,5 @@
-from bean_gym.envs.bean_gym_env import BeanGymEnv
\ No newline at end of file
+from bean_gym.envs.bean_gym_env import BeanGymEnv
+from bean_gym.envs.bean_gym_placement_env import BeanGymPlacementEnv
+from bean_gym.envs.bean_gym_vec_env import BeanGymVecEnv
+from bean_gym.envs.bean_render import ArrayRenderer
+from bean_gym.envs.bean_gym_recorder import BeanGymRecorder
\ No newline at end of file
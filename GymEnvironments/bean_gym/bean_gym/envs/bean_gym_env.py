@@ -7,25 +7,68 @@ This is the OpenAI Gym interface for the MeanBean game.
 """
 
 import gym
+import numpy as np
 from gym import spaces, logger
 from gym.utils import seeding
 
 from bean_machine import BeanMachine
+from bean_bitboard import BitBeanMachine
+from bean_gym.envs.bean_render import ArrayRenderer, FieldBatch, bean_colors
 
-bean_colors =  {0: (1., 1., 1.),    # Nothing (blank space)
-                1: (0., 0., 0.),    # Black
-                2: (1., 0., 0.),    # Red
-                3: (0., 0., 1.),    # Blue
-                4: (0.8, 0.8, 0.),  # Yellow
-                5: (0., 1., 0.),    # Green
-                6: (1., 0., 1.)}    # Purple
+# Observation modes: dtype and shape of the observations they produce
+OBSERVATIONS = {'field': (np.int64, (13, 6)),       # The playing field as is
+                'board': (np.uint8, (13, 6)),       # The playing field as uint8
+                'onehot': (np.uint8, (7, 13, 6)),   # One plane per bean type (0 = blank)
+                'dict': (None, None)}               # Board, next pair and orientation
+
+# Bean type of each one-hot plane
+PLANES = np.arange(7).reshape(7, 1, 1)
+
+def read_only(array):
+    """
+    Read-only view of an array.
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+def observation_space(observation: str):
+    """
+    Observation space of an observation mode (see OBSERVATIONS).
+    """
+    if observation == 'dict':
+        return spaces.Dict({'board': observation_space('board'),
+                            'preview': spaces.Box(low=2, high=6, shape=(2,), dtype=np.uint8),
+                            'orientation': spaces.Discrete(4)})
+
+    dtype, shape = OBSERVATIONS[observation]
+    high = 1 if observation == 'onehot' else 6
+
+    return spaces.Box(low=0, high=high, shape=shape, dtype=dtype)
 
 class BeanGymEnv(gym.Env):
     """
     OpenAI Gym environment for the MeanBean game.
 
     Observation:
-        TBD
+        Chosen with the observation argument:
+        'field'     (13, 6) int64 playing field (the default)
+        'board'     (13, 6) uint8 playing field
+        'onehot'    (7, 13, 6) uint8, plane C marks the spaces holding 
+                    bean type C (plane 0 marks blank spaces)
+        'dict'      {'board': uint8 playing field, 
+                     'preview': uint8 colors of the next pair (top bean first), 
+                     'orientation': Bean 2 rel. to Bean 1, 
+                                    0-3 = above, right, below, left}
+
+        The controlled beans are part of the playing field.
+
+        step() and reset() return read-only views of the environment's 
+        own buffers (or of the playing field itself, for 'field'), 
+        which change on the next step or reset: copy an observation to 
+        keep it. step_into() and reset_into() instead write the 
+        observation into an array supplied by the caller (e.g. the 
+        next slot of a replay buffer), so keeping it costs one copy.
 
     Actions:
         Type: Discrete(6)
@@ -50,6 +93,24 @@ class BeanGymEnv(gym.Env):
 
     Episode Termination:
         A bean is placed on the top row (Game Over).
+
+    Pacing:
+        By default the game runs in real time for human play. Pass 
+        headless=True (e.g. gym.make('BeanGym-v0', headless=True)) 
+        to advance game time in ticks without any wall-clock sleeps.
+
+    Profiling:
+        With profile=True, the game records per-phase timings, chain 
+        depths and beans cleared, totalled over every episode so far. 
+        The totals are returned by stats(), and in info['profile'] at 
+        the end of each episode. Combine them across environments 
+        with bean_machine.merge_stats.
+
+    Rendering:
+        mode='human' opens a window (needs pyglet and a display). 
+        mode='rgb_array' draws with NumPy alone (see ArrayRenderer) 
+        and returns the renderer's buffer, which the next frame 
+        overwrites.
     """
 
     metadata = {
@@ -57,63 +118,234 @@ class BeanGymEnv(gym.Env):
         'video.frames_per_second': 50
     }
 
-    def __init__(self):
+    def __init__(self, seconds_per_frame: float=0.1, frames_per_drop: int=3,
+                    headless: bool=False, clock=None, bitboard: bool=False,
+                    beans=None, repeat_sequence: bool=False, verbose: bool=False,
+                    preview: bool=False, profile: bool=False, observation: str='field',
+                    frame_skip: int=1):
+        """
+        Instantiation
+
+        Args:
+            seconds_per_frame (float, optional): Wall-clock length of one frame 
+                                    in real-time mode. Defaults to 0.1.
+            frames_per_drop (int, optional): Number of frames between automatic 
+                                    drops of the controlled beans. Defaults to 3.
+            headless (bool, optional): If True, run without wall-clock sleeps. 
+                                    Defaults to False.
+            clock (optional): Custom clock object passed through to the 
+                                    BeanMachine. Defaults to None.
+            bitboard (bool, optional): If True, run the game on the bitboard 
+                                    engine (BitBeanMachine). Defaults to False.
+            beans (BeanQueue, optional): Bean sequence to play, e.g. one shared 
+                                    by several environments. Defaults to None, 
+                                    which uses the environment's seed.
+            repeat_sequence (bool, optional): If True, every reset replays the 
+                                    bean sequence from the start. Defaults to False.
+            verbose (bool, optional): If True, the game reports its score and 
+                                    combos on stdout. Defaults to False.
+            preview (bool, optional): If True, rgb_array frames show the next 
+                                    beans to the right of the field. Defaults 
+                                    to False.
+            profile (bool, optional): If True, profile the game (see 
+                                    BeanMachine.enable_profiling). Defaults 
+                                    to False.
+            observation (str, optional): Observation mode, 'field', 'board', 
+                                    'onehot' or 'dict'. Defaults to 'field'.
+            frame_skip (int, optional): Number of decisions each action is 
+                                    repeated for (see 
+                                    BeanMachine.run_until_decision). 
+                                    Defaults to 1.
+        """
+        assert observation in OBSERVATIONS, f"Unknown observation mode {observation!r}"
 
         seed = self.seed()
 
-        # TEMPORARY HARD-CODED INPUT VALUES
-        self.BeanMachine = BeanMachine(seed=seed[0], seconds_per_frame=0.1,
-                                        frames_per_drop=3)
+        machine = BitBeanMachine if bitboard else BeanMachine
+        self.BeanMachine = machine(seed=seed[0], seconds_per_frame=seconds_per_frame,
+                                    frames_per_drop=frames_per_drop,
+                                    headless=headless, clock=clock, beans=beans,
+                                    repeat_sequence=repeat_sequence, verbose=verbose)
+        if profile:
+            self.BeanMachine.enable_profiling()
+        self.frame_skip = frame_skip
 
         # Set up action and observation spaces
         self.action_space      = spaces.Discrete(6)
-        self.observation_space = spaces.Box(low=0, high=6, shape=(13, 6), dtype=int)
-
-        self.viewer = None
-        self.state  = None
+        self.observation_space = observation_space(observation)
+
+        # Buffer the observations are written into, and the read-only view 
+        # of it that is handed out
+        self.observation = observation
+        self.field_view  = None     # (For 'field', a view of the playing field)
+
+        if observation == 'dict':
+            board   = np.zeros((13, 6), dtype=np.uint8)
+            preview = np.zeros(2, dtype=np.uint8)
+            self.buffer = {'board': board, 'preview': preview, 'orientation': 0}
+            self.view   = {'board': read_only(board), 'preview': read_only(preview),
+                            'orientation': 0}
+
+        elif observation != 'field':
+            dtype, shape = OBSERVATIONS[observation]
+            self.buffer  = np.zeros(shape, dtype=dtype)
+            self.view    = read_only(self.buffer)
+
+        self.viewer   = None
+        self.renderer = None
+        self.preview  = preview
+        self.state    = None
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
+
+        # Give the game the matching bean sequence
+        if hasattr(self, 'BeanMachine'):
+            self.BeanMachine.reseed(seed)
+
         return [seed]
 
     def step(self, action):
-        err_msg = "%r (%s) invalid" % (action, type(action))
-        assert self.action_space.contains(action), err_msg
+        reward, done = self.play(action)
+        self.state   = self.observe()
 
-        reward = 0
+        return self.state, reward, done, self.info(done)
 
-        score_before = self.BeanMachine.score
+    def step_into(self, action, out):
+        """
+        Take a step, writing the observation into a caller-supplied buffer 
+        instead of the environment's own.
 
-        self.BeanMachine.action = action
+        Args:
+            action (int): Action to take.
+            out: Array with the shape of the observations (any dtype that 
+                    can hold them), or for 'dict' observations, a dict of 
+                    'board' and 'preview' arrays (its 'orientation' is set).
 
-        # Move through the MeanBean steps until you get to Phase 2, then return control.
-        # (If you start on Phase 2, go until the NEXT time you hit Phase 2 or Game Over.)
-        while True:
-            self.BeanMachine.step()
+        Returns:
+            [tuple]: (out, reward, done, info)
+        """
+        reward, done = self.play(action)
+        self.state   = self.observe_into(out)
 
-            if self.BeanMachine.gameover: break
-            if self.BeanMachine.phase == 2: break
-        
-        self.BeanMachine.action = 0   # Reset action
+        return out, reward, done, self.info(done)
 
-        score_after = self.BeanMachine.score
-        reward += score_after - score_before
+    def play(self, action):
+        """
+        Apply an action and run the game until it needs the next one.
 
-        self.state = self.BeanMachine.field
+        Returns:
+            [tuple]: (reward, done)
+        """
+        err_msg = "%r (%s) invalid" % (action, type(action))
+        assert self.action_space.contains(action), err_msg
 
-        done = self.BeanMachine.gameover
+        # Move through the MeanBean steps until you get to Phase 2, then return control.
+        # (If you start on Phase 2, go until the NEXT time you hit Phase 2 or Game Over.)
+        reward, done, _ = self.BeanMachine.run_until_decision(action, self.frame_skip)
 
         #reward += (not done)   # +0 if Game Over, else +1
 
-        return self.state, reward, done, {}
+        return reward, done
+
+    def observe(self):
+        """
+        Observe the current state of the game.
+
+        Returns:
+            The observation, in the format of the observation mode, as a 
+            read-only view that changes on the next step or reset.
+        """
+        if self.observation == 'field':
+            field = self.BeanMachine.field
+            if self.field_view is None or self.field_view.base is not field:
+                self.field_view = read_only(field)
+            return self.field_view
+
+        self.observe_into(self.buffer)
+        if self.observation == 'dict':
+            self.view['orientation'] = self.buffer['orientation']
+
+        return self.view
+
+    def observe_into(self, out):
+        """
+        Write the observation of the current state of the game into a 
+        buffer (see step_into).
+
+        Returns:
+            The buffer.
+        """
+        machine = self.BeanMachine
+        field   = machine.field
+
+        if self.observation == 'onehot':
+            if out.dtype == np.uint8:
+                np.equal(field, PLANES, out=out.view(np.bool_))
+            else:
+                np.copyto(out, field == PLANES, casting='unsafe')
+
+        elif self.observation == 'dict':
+            np.copyto(out['board'], field, casting='unsafe')
+            out['preview'][0]  = machine.next2
+            out['preview'][1]  = machine.next1
+            out['orientation'] = machine.pair.orientation
+
+        else:
+            np.copyto(out, field, casting='unsafe')
+
+        return out
+
+    def info(self, done):
+        """
+        Info dict for a step: the profiling stats at the end of an episode.
+        """
+        if done and self.BeanMachine.profiler is not None:
+            return {'profile': self.BeanMachine.stats()}
+        return {}
+
+    def stats(self):
+        """
+        Profiling stats of the game so far, or None if profiling is off.
+        """
+        return self.BeanMachine.stats()
 
     def reset(self):
-        self.BeanMachine.reset()
-        self.state = self.BeanMachine.field
+        self.restart()
+        self.state = self.observe()
 
         return self.state
 
+    def reset_into(self, out):
+        """
+        Reset the game, writing the first observation into a caller-supplied 
+        buffer (see step_into).
+
+        Returns:
+            The buffer.
+        """
+        self.restart()
+        self.state = self.observe_into(out)
+
+        return out
+
+    def restart(self):
+        """
+        Reset the game itself.
+        """
+        self.BeanMachine.reset()
+
     def render(self, mode='human'):
+        if mode == 'rgb_array':
+            if self.renderer is None:
+                self.renderer = ArrayRenderer(preview=self.preview)
+
+            if self.state is None:
+                return None
+
+            next_beans = (self.BeanMachine.next2, self.BeanMachine.next1)
+            return self.renderer.render(self.BeanMachine.field, next_beans)
+
         # Field is 6x13 (For now, 'next beans' are invisible)
         world_width   = 6
         world_height  = 13
@@ -125,37 +357,21 @@ class BeanGymEnv(gym.Env):
             from gym.envs.classic_control import rendering
             self.viewer = rendering.Viewer(screen_width, screen_height)
 
-            # Set up the 6x13 grid of squares that will make our playing field
-            self.blocks = []
-
-            for x in range(6):
-                self.blocks.append([])
-                for y in range(13):
-                    l = x*scale
-                    r = (x+1)*scale
-                    b = 13*scale - (y+1)*scale
-                    t = 13*scale - y*scale
-
-                    block = rendering.FilledPolygon([(l, b), (l, t), (r, t), (r, b)])
-
-                    self.viewer.add_geom(block)
-                    self.blocks[x].append(block)
+            # The 6x13 grid of squares that makes up the playing field, 
+            # drawn in one batch
+            self.field_batch = FieldBatch(scale)
+            self.viewer.add_geom(self.field_batch)
 
         if self.state is None:
             return None
 
-        # Color each block according to its field value
-        for x in range(6):
-            for y in range(13):
-                c = self.state[y,x]   # Color index
-
-                red,green,blue = bean_colors[c]
-
-                self.blocks[x][y].set_color(red, green, blue)
+        # Recolor only the squares whose beans have changed
+        self.field_batch.update(self.BeanMachine.field)
 
-        return self.viewer.render(return_rgb_array=mode == 'rgb_array')
+        return self.viewer.render()
 
     def close(self):
         if self.viewer:
+            self.field_batch.delete()
             self.viewer.close()
             self.viewer = None
\ No newline at end of file
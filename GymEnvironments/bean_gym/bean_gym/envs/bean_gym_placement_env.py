@@ -0,0 +1,82 @@
+"""
+bean_gym_placement_env.py
+
+Author: MCK
+
+OpenAI Gym interface for the MeanBean game where each action 
+chooses where the next pair of beans ends up, instead of 
+steering it one move at a time.
+"""
+
+from gym import spaces
+
+from bean_machine import PLACEMENTS
+from bean_gym.envs.bean_gym_env import BeanGymEnv
+
+class BeanGymPlacementEnv(BeanGymEnv):
+    """
+    OpenAI Gym environment for the MeanBean game with placement-level 
+    ("macro") actions.
+
+    Observation:
+        Same as BeanGymEnv.
+
+    Actions:
+        Type: Discrete(22)
+        Num    Placement (column of Bean 1, Bean 2 rel. to Bean 1)
+        0-5    Columns 0-5, Bean 2 above
+        6-11   Columns 0-5, Bean 2 below
+        12-16  Columns 0-4, Bean 2 to the right
+        17-21  Columns 1-5, Bean 2 to the left
+
+        (See bean_machine.PLACEMENTS.) One step steers the pair to the 
+        placement, drops it, resolves every chain and spawns the next 
+        pair. Blocked placements end wherever the pair gets stuck.
+
+    Rewards:
+        Same as BeanGymEnv. Dropping the pair into place counts as a 
+        hard drop.
+
+    Starting State:
+        There are no beans on the playing field, and the first pair of 
+        controllable beans is waiting for a placement.
+
+    Episode Termination:
+        A bean is placed on the top row (Game Over).
+    """
+
+    def __init__(self, seconds_per_frame: float=0.1, frames_per_drop: int=3,
+                    headless: bool=True, clock=None, bitboard: bool=False,
+                    beans=None, repeat_sequence: bool=False, verbose: bool=False,
+                    preview: bool=False, profile: bool=False, observation: str='field'):
+        """
+        Instantiation. Arguments are the same as for BeanGymEnv, except 
+        that the game runs headless by default.
+        """
+        super().__init__(seconds_per_frame=seconds_per_frame, frames_per_drop=frames_per_drop,
+                            headless=headless, clock=clock, bitboard=bitboard,
+                            beans=beans, repeat_sequence=repeat_sequence, verbose=verbose,
+                            preview=preview, profile=profile, observation=observation)
+
+        self.action_space = spaces.Discrete(len(PLACEMENTS))
+
+    def play(self, action):
+        err_msg = "%r (%s) invalid" % (action, type(action))
+        assert self.action_space.contains(action), err_msg
+
+        score_before = self.BeanMachine.score
+
+        column, orientation = PLACEMENTS[action]
+        self.BeanMachine.place(column, orientation)
+
+        reward = self.BeanMachine.score - score_before
+
+        done = self.BeanMachine.gameover
+
+        return reward, done
+
+    def restart(self):
+        self.BeanMachine.reset()
+
+        # Bring in the first pair, so the first step can place it
+        self.BeanMachine.step()
@@ -0,0 +1,76 @@
+"""
+bean_gym_recorder.py
+
+Author: MCK
+
+Gym wrapper that archives every episode of a MeanBean environment
+with bean_recorder.EpisodeRecorder.
+"""
+
+import gym
+
+from bean_recorder import EpisodeRecorder
+from bean_gym.envs.bean_gym_placement_env import BeanGymPlacementEnv
+
+class BeanGymRecorder(gym.Wrapper):
+    """
+    Records the seed, settings and actions of each episode of a
+    BeanGymEnv (or BeanGymPlacementEnv) to an episode archive. An
+    episode is written when it ends, or when the environment is
+    reset or closed before then.
+    """
+
+    def __init__(self, env, path: str):
+        """
+        Instantiation
+
+        Args:
+            env (BeanGymEnv): Environment to record.
+            path (str): Archive file (see bean_recorder).
+        """
+        super().__init__(env)
+        self.recorder  = EpisodeRecorder(path)
+        self.placement = isinstance(env.unwrapped, BeanGymPlacementEnv)
+
+        # (Placements are whole turns, so they are never repeated)
+        self.frame_skip = 1 if self.placement else env.unwrapped.frame_skip
+
+    def reset(self, **kwargs):
+        machine = self.env.unwrapped.BeanMachine
+        self.recorder.end(machine)
+
+        state = self.env.reset(**kwargs)
+        self.recorder.begin(machine, placement=self.placement, frame_skip=self.frame_skip)
+
+        return state
+
+    def reset_into(self, out):
+        machine = self.env.unwrapped.BeanMachine
+        self.recorder.end(machine)
+
+        self.env.reset_into(out)
+        self.recorder.begin(machine, placement=self.placement, frame_skip=self.frame_skip)
+
+        return out
+
+    def step(self, action):
+        return self.recorded(action, self.env.step(action))
+
+    def step_into(self, action, out):
+        return self.recorded(action, self.env.step_into(action, out))
+
+    def recorded(self, action, result):
+        """
+        Record the action of a step, given the step's result.
+        """
+        self.recorder.record(action)
+
+        if result[2]:
+            self.recorder.end(self.env.unwrapped.BeanMachine)
+
+        return result
+
+    def close(self):
+        self.recorder.end(self.env.unwrapped.BeanMachine)
+        self.recorder.close()
+        self.env.close()
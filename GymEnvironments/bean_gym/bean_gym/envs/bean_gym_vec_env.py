@@ -0,0 +1,233 @@
+"""
+bean_gym_vec_env.py
+
+Author: MCK
+
+Vectorized MeanBean environment that runs several BeanGymEnv
+games in worker processes.
+
+Observations, rewards and done flags are never pickled. Each
+worker writes them straight into blocks of shared memory, and
+the learner reads them from NumPy views of the same blocks.
+Only the actions and the (small) info dicts travel through the
+pipes. Finished games are reset inside their worker.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+from gym import spaces
+
+from bean_machine import PLACEMENTS
+from bean_gym.envs.bean_gym_env import BeanGymEnv, OBSERVATIONS, observation_space
+from bean_gym.envs.bean_gym_placement_env import BeanGymPlacementEnv
+
+# multiprocessing typecodes of the observation dtypes
+TYPECODES = {np.int64: 'q', np.uint8: 'B'}
+
+def shared_views(buffers, num_envs, observation='field'):
+    """
+    Wrap the shared memory blocks in NumPy arrays.
+
+    Returns:
+        [tuple]: (observations, terminal observations, rewards, dones)
+    """
+    obs_buf, terminal_buf, reward_buf, done_buf = buffers
+    dtype, shape = OBSERVATIONS[observation]
+
+    obs      = np.frombuffer(obs_buf, dtype=dtype).reshape((num_envs,) + shape)
+    terminal = np.frombuffer(terminal_buf, dtype=dtype).reshape((num_envs,) + shape)
+    rewards  = np.frombuffer(reward_buf, dtype=np.float64)
+    dones    = np.frombuffer(done_buf, dtype=np.bool_)
+
+    return obs, terminal, rewards, dones
+
+def worker(index, remote, parent_remote, buffers, num_envs, env_kwargs, placement, seed):
+    """
+    Run one game in a worker process, answering commands from the pipe.
+
+    Commands are (name, data) tuples:
+        ('step', action)    Take a step, resetting the game if it ends.
+        ('reset', None)     Reset the game.
+        ('close', None)     Shut the worker down.
+    """
+    parent_remote.close()
+
+    obs, terminal, rewards, dones = shared_views(buffers, num_envs,
+                                                    env_kwargs.get('observation', 'field'))
+
+    env = BeanGymPlacementEnv(**env_kwargs) if placement else BeanGymEnv(**env_kwargs)
+
+    if seed is not None:
+        env.seed(seed)
+
+    try:
+        while True:
+            command, data = remote.recv()
+
+            if command == 'step':
+                _, reward, done, info = env.step_into(data, obs[index])
+                if done:
+                    terminal[index] = obs[index]
+                    env.reset_into(obs[index])
+
+                rewards[index] = reward
+                dones[index]   = done
+                remote.send(info)
+
+            elif command == 'reset':
+                env.reset_into(obs[index])
+                remote.send(None)
+
+            elif command == 'close':
+                break
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        env.close()
+        remote.close()
+
+class BeanGymVecEnv():
+    """
+    Runs num_envs MeanBean games in subprocesses and steps them together.
+
+    step() returns NumPy views of the shared memory blocks:
+        observations    (num_envs, ...) observations (see the observation 
+                        modes of BeanGymEnv; 'dict' is not supported)
+        rewards         (num_envs,)
+        dones           (num_envs,)
+    These views are overwritten by the next step, so copy anything that
+    needs to be kept. When a game ends, its worker resets it at once: the
+    observation is the first state of the new game, and the last state of
+    the old one is in terminal_observations.
+
+    Use step_async() and step_wait() to run inference while the workers
+    simulate.
+    """
+
+    def __init__(self, num_envs: int, env_kwargs: dict=None, placement: bool=False,
+                    seeds=None, start_method: str=None):
+        """
+        Instantiation
+
+        Args:
+            num_envs (int): Number of games (and worker processes).
+            env_kwargs (dict, optional): Keyword arguments for each environment.
+                                    Defaults to None, which runs headless.
+            placement (bool, optional): If True, run BeanGymPlacementEnv games
+                                    instead of BeanGymEnv. Defaults to False.
+            seeds (list[int], optional): One random seed per game. Defaults to
+                                    None, which leaves the games unseeded.
+            start_method (str, optional): multiprocessing start method. Defaults
+                                    to None, which uses the platform default.
+        """
+        if env_kwargs is None:
+            env_kwargs = {'headless': True}
+        if seeds is None:
+            seeds = [None]*num_envs
+        assert len(seeds) == num_envs, "Expected one seed per game"
+
+        observation = env_kwargs.get('observation', 'field')
+        assert observation != 'dict', "Dict observations can't be shared as one array"
+
+        self.num_envs  = num_envs
+        self.placement = placement
+
+        # Spaces of a single game
+        self.action_space      = spaces.Discrete(len(PLACEMENTS) if placement else 6)
+        self.observation_space = observation_space(observation)
+
+        ctx = mp.get_context(start_method)
+
+        # Shared memory for everything the workers send back each step
+        dtype, shape = OBSERVATIONS[observation]
+        size = num_envs*int(np.prod(shape))
+        self.buffers = (ctx.RawArray(TYPECODES[dtype], size),
+                        ctx.RawArray(TYPECODES[dtype], size),
+                        ctx.RawArray('d', num_envs),
+                        ctx.RawArray('b', num_envs))
+        self.observations, self.terminal_observations, self.rewards, self.dones = \
+            shared_views(self.buffers, num_envs, observation)
+
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(num_envs)])
+        self.processes = []
+        for index, (work_remote, remote) in enumerate(zip(work_remotes, self.remotes)):
+            args = (index, work_remote, remote, self.buffers, num_envs,
+                    env_kwargs, placement, seeds[index])
+            process = ctx.Process(target=worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.waiting = False
+        self.closed  = False
+
+    def reset(self):
+        """
+        Reset every game.
+
+        Returns:
+            [np.ndarray]: (num_envs, ...) view of the observations.
+        """
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+
+        return self.observations
+
+    def step_async(self, actions):
+        """
+        Send one action to every game without waiting for the results.
+
+        Args:
+            actions (np.ndarray): (num_envs,) array of actions.
+        """
+        for remote, action in zip(self.remotes, actions):
+            remote.send(('step', int(action)))
+        self.waiting = True
+
+    def step_wait(self):
+        """
+        Wait for the steps started by step_async() to finish.
+
+        Returns:
+            [tuple]: (observations, rewards, dones, infos)
+        """
+        infos = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+
+        return self.observations, self.rewards, self.dones, infos
+
+    def step(self, actions):
+        """
+        Take one step in every game.
+
+        Args:
+            actions (np.ndarray): (num_envs,) array of actions.
+
+        Returns:
+            [tuple]: (observations, rewards, dones, infos)
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        if self.closed:
+            return
+
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+
+        self.closed = True
@@ -0,0 +1,167 @@
+"""
+bean_render.py
+
+Author: MCK
+
+Renderers for the MeanBean game.
+
+ArrayRenderer is pure NumPy, for rgb_array frames without pyglet,
+OpenGL or a display (e.g. on Colab or a cluster). FieldBatch draws
+the field in the human viewer.
+
+The playing field is mapped through the bean_colors palette
+(one color per space), then blown up to the screen size in two
+broadcast copies into preallocated buffers: first across each
+row of spaces, then down whole pixel rows. A frame costs a few
+array operations and no allocations.
+"""
+
+import numpy as np
+
+bean_colors =  {0: (1., 1., 1.),    # Nothing (blank space)
+                1: (0., 0., 0.),    # Black
+                2: (1., 0., 0.),    # Red
+                3: (0., 0., 1.),    # Blue
+                4: (0.8, 0.8, 0.),  # Yellow
+                5: (0., 1., 0.),    # Green
+                6: (1., 0., 1.)}    # Purple
+
+# bean_colors as 8-bit RGB, indexed by bean type
+PALETTE = np.array([bean_colors[c] for c in range(7)])
+PALETTE = np.round(255*PALETTE).astype(np.uint8)
+
+PREVIEW_COLOR = 100     # Gray of the panel that shows the next beans
+
+# Vertex colors of one square (4 corners) of each bean type, for FieldBatch
+QUAD_COLORS = [PALETTE[c].tolist()*4 for c in range(7)]
+
+class ArrayRenderer():
+    """
+    Draws the playing field into an RGB image. Each space is a
+    scale x scale square, with row 0 at the top, so the frames match
+    the ones from BeanGymEnv's human viewer.
+
+    With preview=True, the image gets one more column on the right,
+    gray except for the next pair of beans in its top two spaces.
+    """
+
+    def __init__(self, scale: int=50, preview: bool=False):
+        """
+        Instantiation
+
+        Args:
+            scale (int, optional): Width and height of each space in pixels.
+                                    Defaults to 50.
+            preview (bool, optional): If True, show the next beans to the
+                                    right of the field. Defaults to False.
+        """
+        self.scale   = scale
+        self.preview = preview
+
+        columns    = 7 if preview else 6
+        self.image = np.full((13*scale, columns*scale, 3), PREVIEW_COLOR, dtype=np.uint8)
+
+        # One color per space, then one pixel row per row of spaces
+        self.colors = np.empty((13, columns, 3), dtype=np.uint8)
+        self.strip  = np.empty((13, 1, columns, scale, 3), dtype=np.uint8)
+
+        # The image as (row of spaces, pixel row within it, pixels), so each 
+        # strip can be copied down its pixel rows at once
+        self.rows = self.image.reshape(13, scale, columns*scale*3)
+
+    def render(self, field, next_beans=None):
+        """
+        Draw a frame.
+
+        Args:
+            field (np.ndarray): (13, 6) playing field.
+            next_beans (tuple, optional): (next2, next1) colors of the next
+                                    pair, top bean first. Only drawn with
+                                    preview=True. Defaults to None.
+
+        Returns:
+            [np.ndarray]: (height, width, 3) uint8 image. This is the
+                            renderer's own buffer, overwritten by the next
+                            frame, so copy it to keep it.
+        """
+        np.take(PALETTE, field, axis=0, out=self.colors[:, :6])
+
+        if self.preview:
+            self.colors[:, 6] = PREVIEW_COLOR
+            if next_beans is not None:
+                self.colors[:2, 6] = PALETTE[list(next_beans)]
+
+        self.strip[...] = self.colors[:, None, :, None, :]
+        self.rows[...]  = self.strip.reshape(13, 1, -1)
+
+        return self.image
+
+class FieldBatch():
+    """
+    Draws the playing field in a gym Viewer (pyglet) as a single
+    vertex list of 78 squares, in one draw call. The field last drawn
+    is kept, and update() only rewrites the vertex colors of the
+    spaces that have changed since (usually just the moving pair).
+
+    Add it to the viewer with viewer.add_geom(); the viewer calls
+    render() on every frame.
+    """
+
+    def __init__(self, scale: int=50):
+        """
+        Instantiation. Needs pyglet (and a display).
+
+        Args:
+            scale (int, optional): Width and height of each space in pixels.
+                                    Defaults to 50.
+        """
+        import pyglet
+        self.GL_QUADS = pyglet.gl.GL_QUADS
+
+        # Corners of each space, in row-major order (row 0 at the top)
+        vertices = []
+        for y in range(13):
+            for x in range(6):
+                l = x*scale
+                r = (x+1)*scale
+                b = 13*scale - (y+1)*scale
+                t = 13*scale - y*scale
+                vertices += [l, b, l, t, r, t, r, b]
+
+        self.vertex_list = pyglet.graphics.vertex_list(78*4, ('v2f', vertices),
+                                                        ('c3B', QUAD_COLORS[0]*78))
+        self.drawn = np.zeros((13, 6), dtype=int)   # Field the colors were set from
+
+    def update(self, field):
+        """
+        Recolor the spaces that differ from the last field drawn.
+
+        Args:
+            field (np.ndarray): (13, 6) playing field.
+
+        Returns:
+            [int]: Number of spaces recolored.
+        """
+        ys, xs = np.nonzero(field != self.drawn)
+        if len(ys) == 0:
+            return 0
+
+        colors = self.vertex_list.colors
+        for i, c in zip((6*ys + xs).tolist(), field[ys, xs].tolist()):
+            colors[12*i:12*i+12] = QUAD_COLORS[c]
+
+        self.drawn[ys, xs] = field[ys, xs]
+
+        return len(ys)
+
+    def render(self):
+        """
+        Draw the field. Called by the viewer.
+        """
+        self.vertex_list.draw(self.GL_QUADS)
+
+    def delete(self):
+        """
+        Free the vertex list.
+        """
+        self.vertex_list.delete()
@@ -10,7 +10,7 @@ import sys, gym, time
 from gym import wrappers
 import bean_gym
 
-env  = gym.make('BeanGym-v0')
+env  = gym.make('BeanGym-v0', verbose=True)
 mode = 'human'
 
 if mode == 'rgb_array':
@@ -42,9 +42,10 @@ def key_release(key, mod):
     global human_agent_action, human_sets_pause, human_wants_restart
     if key in [65361, 65363, 65364, 97, 100]: human_agent_action = 0
 
-# Set up Gym environment and interactions
+# Set up Gym environment and interactions. The keys are read from the 
+# human viewer's window, which is opened even when recording rgb_array frames.
 env.reset()
-env.render(mode=mode)
+env.render(mode='human')
 env.unwrapped.viewer.window.on_key_press   = key_press
 env.unwrapped.viewer.window.on_key_release = key_release
 
@@ -63,10 +64,10 @@ def rollout(env):
 
         total_reward += r
 
-        window_still_open = env.render(mode=mode)
+        window_still_open = env.render(mode='human')
 
         if mode == 'rgb_array':
-            window_still_open = True
+            env.render(mode=mode)
 
         if window_still_open == False: return False
 
@@ -75,7 +76,7 @@ def rollout(env):
             break
 
         while human_sets_pause:
-            env.render(mode=mode)
+            env.render(mode='human')
 
     print(f"Timesteps: {total_steps}, Reward: {total_reward}")
     print()